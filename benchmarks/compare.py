@@ -0,0 +1,42 @@
+import json
+import argparse
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(old: float, new: float) -> str:
+    return f"{100 * (new - old) / old:+.1f}%" if old else "n/a"
+
+
+def compare(baseline: dict, candidate: dict):
+    print(f"baseline:  {baseline['label']} ({baseline['commit']})")
+    print(f"candidate: {candidate['label']} ({candidate['commit']})")
+    if baseline["config"] != candidate["config"]:
+        print("⚠️ The two runs used a different configuration, compare with care")
+
+    runs = {run["concurrency"]: run for run in baseline["runs"]}
+    for run in candidate["runs"]:
+        base = runs.get(run["concurrency"])
+        if not base:
+            continue
+        print(f"\nconcurrency={run['concurrency']}")
+        print(f"  {'':<28}{'baseline':>12}{'candidate':>12}{'change':>10}")
+        rows = [("rps", base["rps"], run["rps"])]
+        rows += [(f"latency {p} ms", base["latency_ms"].get(p, 0), run["latency_ms"].get(p, 0))
+                 for p in ("p50", "p95", "p99")]
+        for stage, stats in run["stages"].items():
+            if stage in base["stages"]:
+                rows.append((f"{stage} mean ms", base["stages"][stage]["mean_ms"], stats["mean_ms"]))
+        for name, old, new in rows:
+            print(f"  {name:<28}{old:>12.1f}{new:>12.1f}{change(old, new):>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares two benchmark result files")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args()
+    compare(load(args.baseline), load(args.candidate))
@@ -0,0 +1,97 @@
+import os
+import json
+import random
+import argparse
+
+# Synthetic but topical text: nearby queries retrieve nearby chunks, like real course notes
+TOPICS = {
+    "networking": ["TCP", "UDP", "the handshake", "congestion control", "the routing table", "DNS", "a socket"],
+    "databases": ["a transaction", "the B-tree index", "the query planner", "replication", "a write-ahead log"],
+    "operating_systems": ["the scheduler", "virtual memory", "a page fault", "a mutex", "the file system"],
+    "machine_learning": ["gradient descent", "the loss function", "regularization", "a transformer", "attention"],
+    "cloud": ["autoscaling", "a load balancer", "object storage", "a container", "the serverless function"],
+}
+VERBS = ["reduces", "depends on", "is limited by", "improves", "is implemented with", "interacts with"]
+QUALIFIERS = ["under heavy load", "in the worst case", "for small inputs", "when memory is scarce",
+              "in a distributed setting", "compared to the naive approach"]
+QUESTIONS = ["What {verb} {term}?", "How does {term} work {qualifier}?", "Explain {term} in {topic}.",
+             "Why is {term} important {qualifier}?", "Compare {term} and {other}."]
+
+
+def sentence(rng: random.Random, terms: list[str]) -> str:
+    term, other = rng.sample(terms, 2)
+    return f"{term.capitalize()} {rng.choice(VERBS)} {other} {rng.choice(QUALIFIERS)}."
+
+
+def build_corpus(out_dir: str, docs: int = 20, pages: int = 10, seed: int = 0) -> list[str]:
+    """Writes `docs` PDFs of `pages` pages each, deterministic for a given seed."""
+    import pymupdf
+
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    files = []
+    for i in range(docs):
+        topic = topics[i % len(topics)]
+        filename = f"bench_{topic}_{i:03d}.pdf"
+        pdf = pymupdf.open()
+        for p in range(pages):
+            paragraphs = [
+                " ".join(sentence(rng, TOPICS[topic]) for _ in range(rng.randint(4, 8)))
+                for _ in range(4)
+            ]
+            page = pdf.new_page()
+            page.insert_textbox(page.rect + (50, 50, -50, -50),
+                                f"{topic.replace('_', ' ').title()} - part {p + 1}\n\n" + "\n\n".join(paragraphs),
+                                fontsize=9)
+        pdf.save(os.path.join(out_dir, filename))
+        pdf.close()
+        files.append(filename)
+    print(f"📄 Synthetic corpus: {docs} PDFs x {pages} pages in {out_dir}")
+    return files
+
+
+def build_trace(path: str, queries: int = 500, sessions: int = 50, repeat_rate: float = 0.2, seed: int = 0):
+    """
+    Query trace as JSON lines {"query", "session_id"}. A `repeat_rate`
+    share of the queries repeats an earlier one, which is what the caches see.
+    """
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    issued = []
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(queries):
+            if issued and rng.random() < repeat_rate:
+                query = rng.choice(issued)
+            else:
+                topic = rng.choice(topics)
+                term, other = rng.sample(TOPICS[topic], 2)
+                query = rng.choice(QUESTIONS).format(
+                    verb=rng.choice(VERBS), term=term, other=other,
+                    qualifier=rng.choice(QUALIFIERS), topic=topic.replace("_", " ")
+                )
+                issued.append(query)
+            f.write(json.dumps({"query": query, "session_id": f"bench-{rng.randrange(sessions)}"}) + "\n")
+    print(f"🧾 Trace: {queries} queries, {sessions} sessions, repeat rate {repeat_rate} -> {path}")
+
+
+def load_trace(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic corpus and query trace for the benchmarks")
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(__file__), ".work", "data"))
+    parser.add_argument('--docs', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--trace', default=os.path.join(os.path.dirname(__file__), "traces", "default.jsonl"))
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--repeat-rate', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    build_corpus(args.out, args.docs, args.pages, args.seed)
+    os.makedirs(os.path.dirname(args.trace), exist_ok=True)
+    build_trace(args.trace, args.queries, args.sessions, args.repeat_rate, args.seed)
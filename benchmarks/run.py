@@ -0,0 +1,310 @@
+import os
+import sys
+import math
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+from corpus import build_corpus, build_trace, load_trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# (stage, histogram, label filter): read from the /metrics of both services
+STAGES = [
+    ("orchestrator.request", "orchestrator_http_request_seconds", {"route": "{query_route}"}),
+    ("orchestrator.save_message", "orchestrator_save_message_seconds", {}),
+    ("orchestrator.rag_pool_wait", "orchestrator_rag_pool_wait_seconds", {}),
+    ("orchestrator.rag_call", "orchestrator_rag_request_seconds", {"path": "/generate"}),
+    ("rag.request", "rag_http_request_seconds", {"route": "{generate_route}"}),
+    ("rag.embedding", "rag_query_embedding_seconds", {}),
+    ("rag.vector_search", "rag_vector_search_seconds", {}),
+    ("rag.llm", "rag_llm_seconds", {}),
+    ("rag.llm_first_token", "rag_llm_first_token_seconds", {}),
+]
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p):
+        # Nearest-rank percentile
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99),
+            "mean": sum(ordered) / len(ordered), "max": ordered[-1]}
+
+
+def scrape(url: str) -> dict:
+    """{(sample name, sorted labels): value} of one /metrics page."""
+    samples = {}
+    text = httpx.get(f"{url}/metrics", timeout=10).text
+    for family in text_string_to_metric_families(text):
+        for s in family.samples:
+            labels = dict(s.labels)
+            if "le" in labels:
+                labels["le"] = float(labels["le"])  # "+Inf" included
+            samples[(s.name, tuple(sorted(labels.items())))] = s.value
+    return samples
+
+
+def histogram_delta(before: dict, after: dict, name: str, labels: dict) -> dict | None:
+    """count/mean/p50/p95 in ms of the observations between two scrapes (all other labels summed)."""
+    def total(suffix, extra=None):
+        wanted = {**labels, **(extra or {})}
+        return sum(
+            value - before.get(key, 0.0)
+            for key, value in after.items()
+            if key[0] == name + suffix and wanted.items() <= dict(key[1]).items()
+        )
+
+    count = total("_count")
+    if count <= 0:
+        return None
+    bounds = sorted({dict(k[1])["le"] for k in after if k[0] == name + "_bucket"})
+    cumulative = [(b, total("_bucket", {"le": b})) for b in bounds]
+
+    def quantile(q):
+        # Linear interpolation inside the bucket, like PromQL histogram_quantile
+        target, lower, previous = q * count, 0.0, 0.0
+        for bound, seen in cumulative:
+            if seen >= target:
+                if bound == float("inf"):
+                    return lower * 1000
+                share = (target - previous) / (seen - previous) if seen > previous else 0.0
+                return 1000 * (lower + (bound - lower) * share)
+            lower, previous = bound, seen
+        return lower * 1000
+
+    return {"count": int(count), "mean_ms": 1000 * total("_sum") / count,
+            "p50_ms": quantile(0.5), "p95_ms": quantile(0.95)}
+
+
+def stage_breakdown(before: dict, after: dict, stream: bool) -> dict:
+    routes = {"query_route": "/query/stream" if stream else "/query",
+              "generate_route": "/generate/stream" if stream else "/generate"}
+    stages = {}
+    for stage, name, labels in STAGES:
+        labels = {k: v.format(**routes) for k, v in labels.items()}
+        stats = histogram_delta(before, after, name, labels)
+        if stats:
+            stages[stage] = stats
+    return stages
+
+
+async def replay(url: str, trace: list[dict], concurrency: int, stream: bool) -> dict:
+    """Closed loop: `concurrency` clients, each sends its next query as soon as the previous one ends."""
+    latencies, first_bytes, errors = [], [], 0
+    queue = asyncio.Queue()
+    for item in trace:
+        queue.put_nowait(item)
+
+    async def client(http: httpx.AsyncClient):
+        nonlocal errors
+        while not queue.empty():
+            item = queue.get_nowait()
+            started = time.monotonic()
+            try:
+                if stream:
+                    async with http.stream("POST", f"{url}/query/stream", json=item) as response:
+                        response.raise_for_status()
+                        first = None
+                        async for _ in response.aiter_bytes():
+                            if first is None:
+                                first = time.monotonic() - started
+                    first_bytes.append(1000 * first if first is not None else 0.0)
+                else:
+                    response = await http.post(f"{url}/query", json=item)
+                    response.raise_for_status()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(1000 * (time.monotonic() - started))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as http:
+        started = time.monotonic()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        duration = time.monotonic() - started
+
+    result = {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": duration,
+        "rps": len(latencies) / duration if duration else 0.0,
+        "latency_ms": percentiles(latencies),
+    }
+    if stream:
+        result["first_byte_ms"] = percentiles(first_bytes)
+    return result
+
+
+def service_env(args, work: str) -> dict:
+    env = dict(os.environ)
+    # Local, deterministic backends: no Gemini, no DynamoDB, no Chroma server, no S3
+    env.pop("CHROMA_SERVER_HOST", None)
+    env.update({
+        "PYTHONUNBUFFERED": "1",
+        "LLM_BACKEND": "stub",
+        "STUB_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "STUB_LLM_LATENCY_SIGMA": str(args.llm_sigma),
+        "STUB_LLM_FIRST_TOKEN_MS": str(args.llm_first_token_ms),
+        "STUB_LLM_ERROR_RATE": str(args.llm_error_rate),
+        "DATA_DIR": os.path.join(work, "data"),
+        "CHROMA_DIR": os.path.join(work, "chroma"),
+        "CATALOG_PATH": os.path.join(work, "catalog.db"),
+        "VECTOR_INDEX_DIR": os.path.join(work, "vector_index"),
+        "SEMANTIC_CACHE_PATH": os.path.join(work, "semantic_cache.db"),
+        "USE_DYNAMODB": "false",
+        "LOCAL_HISTORY_BACKEND": args.history,
+        "LOCAL_HISTORY_JSON": os.path.join(work, "chat_history.json"),
+        "LOCAL_HISTORY_DB": os.path.join(work, "chat_history.db"),
+        "RAG_SERVICE_URL": f"http://127.0.0.1:{args.rag_port}",
+    })
+    for override in args.env:
+        key, _, value = override.partition("=")
+        env[key] = value
+    return env
+
+
+def start_service(name: str, port: int, env: dict, work: str) -> subprocess.Popen:
+    log = open(os.path.join(work, f"{name}.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.join(ROOT, name), env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}, see the logs in .work/")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def print_report(results: dict):
+    print(f"\n📊 {results['label']} @ {results['commit']}")
+    for run in results["runs"]:
+        lat = run["latency_ms"]
+        print(f"\nconcurrency={run['concurrency']}  requests={run['requests']}  errors={run['errors']}  "
+              f"rps={run['rps']:.1f}")
+        if lat:
+            print(f"  latency ms   p50={lat['p50']:.0f}  p95={lat['p95']:.0f}  p99={lat['p99']:.0f}  "
+                  f"max={lat['max']:.0f}")
+        if run.get("first_byte_ms"):
+            fb = run["first_byte_ms"]
+            print(f"  first byte   p50={fb['p50']:.0f}  p95={fb['p95']:.0f}  p99={fb['p99']:.0f}")
+        for stage, stats in run["stages"].items():
+            print(f"  {stage:<28} n={stats['count']:<6} mean={stats['mean_ms']:8.1f}  "
+                  f"p50~{stats['p50_ms']:8.1f}  p95~{stats['p95_ms']:8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a query trace against orchestrator + rag_service")
+    parser.add_argument('--trace', default=None, help='JSON lines {"query", "session_id"} (generated if omitted)')
+    parser.add_argument('--queries', type=int, default=300, help='Size of the generated trace')
+    parser.add_argument('--repeat-rate', type=float, default=0.2,
+                        help='Share of repeated queries in the generated trace')
+    parser.add_argument('--concurrency', default="1,8,32", help='Comma separated levels, one run each')
+    parser.add_argument('--warmup', type=int, default=10, help='Queries sent before every run, not measured')
+    parser.add_argument('--stream', action='store_true', help='Use /query/stream instead of /query')
+    parser.add_argument('--docs', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--llm-latency-ms', type=float, default=800)
+    parser.add_argument('--llm-sigma', type=float, default=0.3)
+    parser.add_argument('--llm-first-token-ms', type=float, default=200)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help='Share of failing LLM calls')
+    parser.add_argument('--history', choices=["json", "sqlite"], default="json")
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE passed to both services')
+    parser.add_argument('--rag-port', type=int, default=18002)
+    parser.add_argument('--orchestrator-port', type=int, default=18001)
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DIR, ".work"))
+    parser.add_argument('--label', default=None, help='Name of the result file')
+    args = parser.parse_args()
+
+    work = os.path.abspath(args.work_dir)
+    os.makedirs(work, exist_ok=True)
+    env = service_env(args, work)
+
+    if not os.path.isdir(env["DATA_DIR"]) or not os.listdir(env["DATA_DIR"]):
+        build_corpus(env["DATA_DIR"], args.docs, args.pages)
+    trace_path = args.trace or os.path.join(work, "trace.jsonl")
+    if not os.path.exists(trace_path):
+        build_trace(trace_path, args.queries, repeat_rate=args.repeat_rate)
+    trace = load_trace(trace_path)
+
+    # Incremental thanks to the manifests: only the first run really embeds the corpus
+    print("📥 Ingesting the corpus...")
+    subprocess.run([sys.executable, "ingest.py"], cwd=os.path.join(ROOT, "rag_service"), env=env, check=True,
+                   stdout=open(os.path.join(work, "ingest.log"), "w"), stderr=subprocess.STDOUT)
+
+    rag_url = f"http://127.0.0.1:{args.rag_port}"
+    orchestrator_url = f"http://127.0.0.1:{args.orchestrator_port}"
+    rag = start_service("rag_service", args.rag_port, env, work)
+    orchestrator = start_service("orchestrator", args.orchestrator_port, env, work)
+    try:
+        started = time.monotonic()
+        wait_ready(f"{rag_url}/readyz", rag)
+        wait_ready(f"{orchestrator_url}/stats", orchestrator)
+        print(f"✅ Services ready in {time.monotonic() - started:.1f}s")
+
+        runs = []
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            asyncio.run(replay(orchestrator_url, trace[:args.warmup], concurrency, args.stream))
+            before = {**scrape(orchestrator_url), **scrape(rag_url)}
+            run = asyncio.run(replay(orchestrator_url, trace, concurrency, args.stream))
+            after = {**scrape(orchestrator_url), **scrape(rag_url)}
+            run["stages"] = stage_breakdown(before, after, args.stream)
+            runs.append(run)
+            print(f"concurrency={concurrency}: {run['rps']:.1f} rps, p95 {run['latency_ms'].get('p95', 0):.0f} ms")
+    finally:
+        for process in (orchestrator, rag):
+            process.terminate()
+            process.wait(timeout=30)
+
+    commit = git_revision()
+    results = {
+        "label": args.label or commit,
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "trace": trace_path, "queries": len(trace), "stream": args.stream, "history": args.history,
+            "llm_latency_ms": args.llm_latency_ms, "llm_sigma": args.llm_sigma,
+            "llm_error_rate": args.llm_error_rate, "env": args.env,
+        },
+        "runs": runs,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}_{results['label']}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print_report(results)
+    print(f"\n💾 Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
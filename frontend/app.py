@@ -1,6 +1,6 @@
 import chainlit as cl
 import httpx
-from constants import QUERY_URL, HISTORY_URL
+from constants import QUERY_STREAM_URL, HISTORY_URL, HISTORY_PAGE_SIZE, REQUEST_ID_HEADER
 
 
 @cl.oauth_callback
@@ -29,25 +29,8 @@ async def on_chat_start():
 
     try:
         print(f"Fetching history for {session_id}...")
-        history_url = f"{HISTORY_URL}/{session_id}"
-        response = await client.get(history_url)
-
-        if response.status_code == 200:
-            history = response.json()
-            if history:
-                for msg in history:
-                    msg_type = "assistant_message"
-                    author = "Assistant"
-
-                    if msg["role"] == "user":
-                        msg_type = "user_message"
-                        author = user.identifier
-
-                    await cl.Message(
-                        content=msg["content"],
-                        author=author,
-                        type=msg_type
-                    ).send()
+        # Only the latest page, older messages are loaded on demand
+        await show_history_page(client, session_id)
 
     except Exception as e:
         print(f"Error loading history: {e}")
@@ -55,6 +38,54 @@ async def on_chat_start():
         await cl.Message(content=f"⚠️ Warning: Could not load chat history. ({e})").send()
 
 
+async def show_history_page(client: httpx.AsyncClient, session_id: str, before: str | None = None):
+    params = {"limit": HISTORY_PAGE_SIZE}
+    if before:
+        params["before"] = before
+    response = await client.get(f"{HISTORY_URL}/{session_id}", params=params)
+    response.raise_for_status()
+    page = response.json()
+
+    for msg in page["messages"]:
+        msg_type = "assistant_message"
+        author = "Assistant"
+
+        if msg["role"] == "user":
+            msg_type = "user_message"
+            author = session_id
+
+        await cl.Message(
+            content=msg["content"],
+            author=author,
+            type=msg_type
+        ).send()
+
+    if page["next_before"]:
+        await cl.Message(
+            content="",
+            actions=[
+                cl.Action(
+                    name="load_older_history",
+                    payload={"before": page["next_before"]},
+                    label="⬆️ Load older messages"
+                )
+            ]
+        ).send()
+
+
+@cl.action_callback("load_older_history")
+async def on_load_older_history(action: cl.Action):
+    client = cl.user_session.get("http_client")
+    session_id = cl.user_session.get("session_id")
+    await action.remove()
+    try:
+        await cl.Message(content="🕘 Older messages:").send()
+        await show_history_page(client, session_id, before=action.payload["before"])
+    except Exception as e:
+        print(f"Error loading older history: {e}")
+        await cl.Message(content=f"⚠️ Warning: Could not load older messages. ({e})").send()
+
+
 @cl.on_message
 async def on_message(message: cl.Message):
     client = cl.user_session.get("http_client")
@@ -69,22 +100,32 @@ async def on_message(message: cl.Message):
             "session_id": session_id
         }
 
-        response = await client.post(QUERY_URL, json=payload)
-        response.raise_for_status()
-
-        data = response.json()
-        answer = data.get("answer", "Error")
+        # Tokens are shown as soon as the backend produces them.
+        # The Chainlit message id doubles as request ID across the backend services
+        headers = {REQUEST_ID_HEADER: message.id}
+        async with client.stream("POST", QUERY_STREAM_URL, json=payload, headers=headers) as response:
+            response.raise_for_status()
+            async for token in response.aiter_text():
+                await msg.stream_token(token)
 
-        msg.content = answer
         await msg.update()
 
     except httpx.HTTPStatusError as e:
-        # Handle backend errors (e.g., the 500 error we built)
-        msg.content = f"Error from backend: {e.response.status_code}"
+        if e.response.status_code == 429:
+            # Admission control refused the query: not an error, just come back later
+            retry_after = e.response.headers.get("Retry-After", "a few")
+            msg.content = f"⏳ The assistant is busy right now, please retry in {retry_after} seconds."
+        else:
+            # Handle backend errors (e.g., the 500 error we built)
+            msg.content = f"Error from backend: {e.response.status_code} (request {message.id})"
+        await msg.update()
+    except httpx.RemoteProtocolError:
+        # The backend aborted the stream mid-answer: keep what arrived, flag it as incomplete
+        msg.content += f"\n\n⚠️ The answer was interrupted, please retry (request {message.id})"
         await msg.update()
     except httpx.RequestError:
         # Handle connection errors (e.g., FastAPI server is not running)
-        msg.content = f"Error: Cannot connect to backend at {QUERY_URL}. Is it running?"
+        msg.content = f"Error: Cannot connect to backend at {QUERY_STREAM_URL}. Is it running?"
         await msg.update()
     except Exception as e:
         # Handle any other errors
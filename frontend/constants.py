@@ -4,4 +4,11 @@ import os
 # In Docker (via docker-compose) it will use "http://backend:8000"
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 QUERY_URL = f"{BACKEND_URL}/query"
+QUERY_STREAM_URL = f"{BACKEND_URL}/query/stream"
 HISTORY_URL = f"{BACKEND_URL}/history"
+
+# Forwarded by the orchestrator to rag-service, links the logs of one question
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# messages loaded when the chat opens, and per "load older" click
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "30"))
@@ -13,6 +13,9 @@ ALLOWED_IDS = [x.strip() for x in raw_ids.split(',') if x.strip()]
 
 BASE_URL = f"https://api.telegram.org/bot{TOKEN}"
 
+# /files listing kept across warm invocations, revalidated with its ETag
+_files_cache = {"etag": None, "files": []}
+
 
 def sanitize_filename(filename):
     """Sostituisce spazi e caratteri non alfanumerici con underscore"""
@@ -89,16 +92,12 @@ def lambda_handler(event, context):
                         return {'statusCode': 200}
 
                     try:
-                        api_url = f"{ORCHESTRATOR_URL.rstrip('/')}/files"
-                        req = urllib.request.Request(api_url)
-                        with urllib.request.urlopen(req) as response:
-                            data = json.loads(response.read())
-                            files = data.get("files", [])
-                            if files:
-                                file_list = "\n".join([f"- <code>{f}</code>" for f in files])
-                                send_message(chat_id, f"📂 <b>Files in the system:</b>\n{file_list}")
-                            else:
-                                send_message(chat_id, "📭 No files found.")
+                        files = fetch_files()
+                        if files:
+                            file_list = "\n".join([f"- <code>{f}</code>" for f in files])
+                            send_message(chat_id, f"📂 <b>Files in the system:</b>\n{file_list}")
+                        else:
+                            send_message(chat_id, "📭 No files found.")
                     except Exception as e:
                         print(f"List error: {e}")
                         send_message(chat_id, f"❌ Error retrieving list: {e}")
@@ -136,6 +135,22 @@ def lambda_handler(event, context):
         return {'statusCode': 500}
 
 
+def fetch_files():
+    """File names from the orchestrator; a 304 means our cached list is still current."""
+    api_url = f"{ORCHESTRATOR_URL.rstrip('/')}/files"
+    headers = {"If-None-Match": _files_cache["etag"]} if _files_cache["etag"] else {}
+    req = urllib.request.Request(api_url, headers=headers)
+    try:
+        with urllib.request.urlopen(req) as response:
+            data = json.loads(response.read())
+            _files_cache["etag"] = response.headers.get("ETag")
+            _files_cache["files"] = data.get("files", [])
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+    return _files_cache["files"]
+
+
 def get_telegram_file_path(file_id):
     """Calls getFile to obtain the remote path on the Telegram server"""
     url = f"{BASE_URL}/getFile?file_id={file_id}"
@@ -7,7 +7,8 @@ import boto3
 def lambda_handler(event, context):
     s3 = boto3.client('s3')
     # Reads the S3 event
-    # It contains info about the uploaded file
+    # It can contain many uploaded files: they are sent to the RAG in a single batch
+    files = []
     for record in event['Records']:
         bucket_name = record['s3']['bucket']['name']
         file_key = record['s3']['object']['key']
@@ -22,29 +23,33 @@ def lambda_handler(event, context):
         except Exception as e:
             print(f"Warning: Could not read metadata: {e}")
 
-        # The RAG URL is passed as an environment variable from Terraform
-        rag_api_url = os.environ['RAG_INGEST_API_URL']  # E.g., https://am-cloud.../ingest-s3
-
-        payload = {
+        files.append({
             "file_key": file_key,
             "chat_id": chat_id
-        }
+        })
 
-        # Calls the RAG Service (Webhook)
-        try:
-            req = urllib.request.Request(
-                rag_api_url,
-                data=json.dumps(payload).encode('utf-8'),
-                headers={'Content-Type': 'application/json'}
-            )
-            response = urllib.request.urlopen(req)
-            print(f"RAG Service responded: {response.read().decode('utf-8')}")
+    if not files:
+        return {'statusCode': 200, 'body': json.dumps('No files in the event')}
 
-        except Exception as e:
-            print(f"Error calling RAG Service: {e}")
-            raise e
+    # The RAG URL is passed as an environment variable from Terraform
+    rag_api_url = os.environ['RAG_INGEST_API_URL']  # E.g., https://am-cloud.../ingest-s3
+    batch_url = rag_api_url.rstrip('/') + '/batch'
+
+    # Calls the RAG Service (Webhook): one job for the whole event
+    try:
+        req = urllib.request.Request(
+            batch_url,
+            data=json.dumps({"files": files}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        response = urllib.request.urlopen(req)
+        print(f"RAG Service responded: {response.read().decode('utf-8')}")
+
+    except Exception as e:
+        print(f"Error calling RAG Service: {e}")
+        raise e
 
     return {
         'statusCode': 200,
-        'body': json.dumps('Notification sent to RAG Service')
+        'body': json.dumps(f'Notification sent to RAG Service for {len(files)} files')
     }
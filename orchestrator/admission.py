@@ -0,0 +1,135 @@
+import math
+import time
+import asyncio
+from collections import OrderedDict
+from metrics import ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS
+from constants import (
+    ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT,
+    SESSION_RATE_PER_MINUTE, SESSION_BURST, SESSION_BUCKETS_MAX
+)
+
+
+class Rejected(Exception):
+    """The request is refused; the client should retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """0 when a token was taken, otherwise the seconds until the next one."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class AdmissionController:
+    """
+    Decides at the door whether a query is worth starting: a token bucket
+    per session, then at most `max_concurrent` queries in progress and
+    `max_queue` waiting, each for at most `queue_timeout` seconds. Anything
+    else is refused right away with a Retry-After hint, instead of timing
+    out after a minute.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+                 max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 session_rate_per_minute: float = SESSION_RATE_PER_MINUTE,
+                 session_burst: int = SESSION_BURST,
+                 max_sessions: int = SESSION_BUCKETS_MAX):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.session_rate = session_rate_per_minute / 60
+        self.session_burst = session_burst
+        self.max_sessions = max_sessions
+        self._buckets = OrderedDict()  # session_id -> TokenBucket, least recently used first
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._active = 0
+        self._waiting = 0
+        self._service_time = 1.0  # moving average of the seconds a query holds its slot
+        self._stats = {"admitted": 0, "rate_limited": 0, "overloaded": 0, "queue_timeout": 0}
+
+    def _bucket(self, session_id: str) -> TokenBucket:
+        bucket = self._buckets.pop(session_id, None) or TokenBucket(self.session_rate, self.session_burst)
+        self._buckets[session_id] = bucket
+        if len(self._buckets) > self.max_sessions:
+            self._buckets.popitem(last=False)  # a forgotten session just starts with a full bucket
+        return bucket
+
+    def _reject(self, reason: str, retry_after: float):
+        self._stats[reason] += 1
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        raise Rejected(reason, retry_after)
+
+    def _drain_estimate(self) -> float:
+        # Roughly when the queue ahead of a new request will have moved
+        return self._service_time * (self._waiting + 1) / self.max_concurrent
+
+    async def admit(self, session_id: str):
+        """
+        Waits for a slot or raises Rejected. Returns the release callback,
+        to be called once the query is over (safe to call more than once).
+        """
+        bucket = self._bucket(session_id)
+        wait = bucket.take()
+        if wait:
+            self._reject("rate_limited", wait)
+
+        started = time.monotonic()
+        try:
+            if self._slots.locked():
+                if self._waiting >= self.max_queue:
+                    self._reject("overloaded", self._drain_estimate())
+                self._waiting += 1
+                try:
+                    await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+                except asyncio.TimeoutError:
+                    self._reject("queue_timeout", self._drain_estimate())
+                finally:
+                    self._waiting -= 1
+            else:
+                await self._slots.acquire()
+        except BaseException:
+            # Not admitted because of the server (or the client left): the session keeps its token
+            bucket.refund()
+            raise
+
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started)
+        self._stats["admitted"] += 1
+        self._active += 1
+        admitted_at = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self._active -= 1
+            self._service_time = 0.9 * self._service_time + 0.1 * (time.monotonic() - admitted_at)
+            self._slots.release()
+
+        return release
+
+    def stats(self) -> dict:
+        return {**self._stats, "active": self._active, "waiting": self._waiting,
+                "max_concurrent": self.max_concurrent, "max_queue": self.max_queue,
+                "sessions": len(self._buckets), "avg_service_s": round(self._service_time, 3)}
@@ -5,3 +5,43 @@ RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL", "http://rag-service:8002")
 # for when using DynamoDB
 USE_DYNAMODB = os.getenv("USE_DYNAMODB", "false")
 DYNAMODB_TABLE = os.getenv("DYNAMODB_TABLE", "ChatHistory")
+
+# local history (when not using DynamoDB): "sqlite" or "json"
+LOCAL_HISTORY_BACKEND = os.getenv("LOCAL_HISTORY_BACKEND", "sqlite")
+LOCAL_HISTORY_DB = os.getenv("LOCAL_HISTORY_DB", "chat_history.db")
+# legacy JSON file, imported once into SQLite
+LOCAL_HISTORY_JSON = os.getenv("LOCAL_HISTORY_JSON", "chat_history.json")
+
+# /history pagination
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+
+# write-behind history persistence
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "25"))  # DynamoDB BatchWriteItem max
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.2"))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))
+
+# pooled HTTP client towards rag-service
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false")
+# per-route read timeouts (seconds)
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "60"))
+INGEST_TIMEOUT = float(os.getenv("INGEST_TIMEOUT", "30"))
+FILES_TIMEOUT = float(os.getenv("FILES_TIMEOUT", "10"))
+
+# single-flight: identical in-flight queries share one rag-service call
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true")
+# also key on the corpus version reported by rag-service (X-Corpus-Version)
+SINGLE_FLIGHT_BY_CORPUS_VERSION = os.getenv("SINGLE_FLIGHT_BY_CORPUS_VERSION", "true")
+
+# admission control on /query: per-session token bucket + global concurrency and queue limits
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))  # seconds a request may wait for a slot
+SESSION_RATE_PER_MINUTE = float(os.getenv("SESSION_RATE_PER_MINUTE", "20"))
+SESSION_BURST = int(os.getenv("SESSION_BURST", "5"))
+SESSION_BUCKETS_MAX = int(os.getenv("SESSION_BUCKETS_MAX", "10000"))
@@ -1,10 +1,12 @@
 import json
 import os
+import sqlite3
+import threading
 import boto3
 from boto3.dynamodb.conditions import Key
 from datetime import datetime
 from abc import ABC, abstractmethod
-from constants import USE_DYNAMODB
+from constants import USE_DYNAMODB, LOCAL_HISTORY_BACKEND, LOCAL_HISTORY_DB, LOCAL_HISTORY_JSON
 
 
 class ChatHistoryRepository(ABC):
@@ -13,7 +15,16 @@ class ChatHistoryRepository(ABC):
         pass
 
     @abstractmethod
-    def get_history(self, session_id: str):
+    def save_messages(self, messages: list[dict]):
+        """Stores a batch of {session_id, role, content, timestamp} in one go."""
+        pass
+
+    @abstractmethod
+    def get_history(self, session_id: str, limit: int | None = None, before: str | None = None):
+        """
+        Messages of the session in chronological order. With `limit`, only the
+        newest `limit` ones; with `before`, only those older than that timestamp.
+        """
         pass
 
 # Implementation 1: Local JSON File
@@ -50,11 +61,114 @@ class LocalJsonRepository(ChatHistoryRepository):
         data[session_id].append(message_entry)
         self._save_data(data)
 
-    def get_history(self, session_id: str):
+    def save_messages(self, messages: list[dict]):
         data = self._load_data()
-        return data.get(session_id, [])
+        for msg in messages:
+            data.setdefault(msg["session_id"], []).append(
+                {"role": msg["role"], "content": msg["content"], "timestamp": msg["timestamp"]}
+            )
+        self._save_data(data)
 
-#  Implementation 2: DynamoDB
+    def get_history(self, session_id: str, limit: int | None = None, before: str | None = None):
+        data = self._load_data()
+        messages = data.get(session_id, [])
+        if before:
+            messages = [m for m in messages if m["timestamp"] < before]
+        return messages[-limit:] if limit else messages
+
+# Implementation 2: Local SQLite (WAL)
+
+
+class SQLiteRepository(ChatHistoryRepository):
+    """
+    Append-only message table indexed by (session_id, id): an append is a
+    single INSERT and a read only touches the rows of that session.
+    WAL mode lets readers run alongside a writer, and SQLite serializes
+    concurrent writers (threads or uvicorn workers) instead of losing them.
+    """
+
+    def __init__(self, filepath=LOCAL_HISTORY_DB, legacy_json=LOCAL_HISTORY_JSON):
+        self.filepath = filepath
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session_ts ON messages (session_id, timestamp, id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        self._migrate_json(legacy_json)
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads, one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.filepath, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _migrate_json(self, legacy_json):
+        """One-time import of the old chat_history.json, if there is one."""
+        if not legacy_json or not os.path.exists(legacy_json):
+            return
+        conn = self._conn()
+        with conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+                return
+            try:
+                with open(legacy_json, "r") as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Error reading {legacy_json}, skipping migration: {e}")
+                return
+            rows = [
+                (session_id, msg["role"], msg["content"], msg.get("timestamp", ""))
+                for session_id, messages in data.items()
+                for msg in messages
+            ]
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)", rows
+            )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)", (datetime.now().isoformat(),))
+        print(f"Migrated {len(rows)} messages from {legacy_json} to {self.filepath}")
+
+    def save_message(self, session_id: str, role: str, content: str):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, datetime.now().isoformat())
+            )
+
+    def save_messages(self, messages: list[dict]):
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(m["session_id"], m["role"], m["content"], m["timestamp"]) for m in messages]
+            )
+
+    def get_history(self, session_id: str, limit: int | None = None, before: str | None = None):
+        # Newest first on the index, then flipped back to chronological order
+        rows = self._conn().execute(
+            "SELECT role, content, timestamp FROM messages WHERE session_id = ? AND timestamp < ? "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (session_id, before or "\uffff", limit or -1)
+        ).fetchall()
+        return [
+            {"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in reversed(rows)
+        ]
+
+#  Implementation 3: DynamoDB
 
 
 class DynamoDBRepository(ChatHistoryRepository):
@@ -76,17 +190,42 @@ class DynamoDBRepository(ChatHistoryRepository):
         except Exception as e:
             print(f"Error saving to DynamoDB: {e}")
 
-    def get_history(self, session_id: str):
+    def save_messages(self, messages: list[dict]):
+        # batch_writer groups the puts in BatchWriteItem calls of up to 25 items
+        with self.table.batch_writer(overwrite_by_pkeys=['session_id', 'timestamp']) as batch:
+            for msg in messages:
+                batch.put_item(
+                    Item={
+                        'session_id': msg['session_id'],
+                        'timestamp': msg['timestamp'],
+                        'role': msg['role'],
+                        'content': msg['content']
+                    }
+                )
+
+    def get_history(self, session_id: str, limit: int | None = None, before: str | None = None):
+        condition = Key('session_id').eq(session_id)
+        if before:
+            condition = condition & Key('timestamp').lt(before)
+        query_args = {
+            'KeyConditionExpression': condition,
+            'ScanIndexForward': False  # newest first, on the sort key
+        }
+        items = []
         try:
-            response = self.table.query(
-                KeyConditionExpression=Key('session_id').eq(session_id)
-            )
-            items = response.get('Items', [])
-            items.sort(key=lambda x: x['timestamp'])
-            return items
+            # A single query stops at 1 MB: follow LastEvaluatedKey until we have enough
+            while True:
+                if limit:
+                    query_args['Limit'] = limit - len(items)
+                response = self.table.query(**query_args)
+                items.extend(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response or (limit and len(items) >= limit):
+                    break
+                query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
         except Exception as e:
             print(f"Error reading from DynamoDB: {e}")
-            return []
+        items.reverse()
+        return items
 
 
 def get_repository():
@@ -94,4 +233,6 @@ def get_repository():
         table_name = os.getenv("DYNAMODB_TABLE", "cloud-nlp-history")
         return DynamoDBRepository(table_name)
 
-    return LocalJsonRepository()
+    if LOCAL_HISTORY_BACKEND.lower() == "json":
+        return LocalJsonRepository(LOCAL_HISTORY_JSON)
+    return SQLiteRepository()
@@ -1,13 +1,43 @@
 # orchestrator/main.py
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from database import get_repository
+from write_behind import WriteBehindRepository
+from rag_client import RAGClient
+from single_flight import SingleFlight
+from admission import AdmissionController, Rejected
+from metrics import RequestContextMiddleware, log, metrics_response
 import httpx
-from constants import RAG_SERVICE_URL
+from constants import (
+    HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, QUERY_TIMEOUT, INGEST_TIMEOUT, FILES_TIMEOUT
+)
 
-app = FastAPI()
+# History writes are batched in the background, off the /query path
+db = WriteBehindRepository(get_repository())
+# One pooled keep-alive client to rag-service for the whole app
+rag = RAGClient()
+# Identical questions in flight at the same time share one rag-service call
+flights = SingleFlight()
+# Sheds load at the door with a fast 429 instead of letting queries time out
+admission = AdmissionController()
+# Last /files listing from rag-service, revalidated with its ETag
+files_cache = {"etag": None, "body": None}
 
-db = get_repository()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.start()
+    await rag.start()
+    yield
+    await db.stop()
+    await rag.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestContextMiddleware)
 
 
 class QueryRequest(BaseModel):
@@ -24,22 +54,47 @@ class IngestRequest(BaseModel):
     chat_id: str | None = None
 
 
+class IngestBatchRequest(BaseModel):
+    files: list[IngestRequest]
+
+
+async def generate(query: str) -> str:
+    response = await rag.request("POST", "/generate", QUERY_TIMEOUT, json={"query": query})
+    response.raise_for_status()
+    flights.observe_version(response.headers)
+    return response.json()["answer"]
+
+
+async def stream_generate(query: str, broadcast):
+    async with rag.stream("POST", "/generate/stream", QUERY_TIMEOUT, json={"query": query}) as upstream:
+        upstream.raise_for_status()
+        flights.observe_version(upstream.headers)
+        broadcast.start()
+        async for chunk in upstream.aiter_text():
+            await broadcast.publish(chunk)
+
+
+async def admit(session_id: str):
+    try:
+        return await admission.admit(session_id)
+    except Rejected as e:
+        log(f"Query from {session_id} rejected: {e.reason}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy ({e.reason}), retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
 @app.post("/query", response_model=QueryResponse)
 async def handle_query(request: QueryRequest):  # Ora è async perché usiamo httpx
+    release = await admit(request.session_id)
     try:
-        db.save_message(request.session_id, "user", request.query)
+        await db.asave_message(request.session_id, "user", request.query)
 
-        # Call RAG service
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{RAG_SERVICE_URL}/generate",
-                json={"query": request.query}
-            )
-            response.raise_for_status()
-            rag_data = response.json()
-            answer = rag_data["answer"]
+        answer = await flights.do("/generate", request.query, lambda: generate(request.query))
 
-        db.save_message(request.session_id, "assistant", answer)
+        await db.asave_message(request.session_id, "assistant", answer)
 
         return QueryResponse(answer=answer)
 
@@ -47,44 +102,133 @@ async def handle_query(request: QueryRequest):  # Ora è async perché usiamo ht
         raise HTTPException(status_code=503, detail="RAG Service unavailable")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        release()
+
+
+@app.post("/query/stream")
+async def handle_query_stream(request: QueryRequest):
+    """
+    Relays the answer chunks from the RAG service as they are generated.
+    Identical questions asked meanwhile subscribe to the same upstream stream.
+    """
+    # The slot is held until the stream is over, released by relay()
+    release = await admit(request.session_id)
+    try:
+        await db.asave_message(request.session_id, "user", request.query)
+        broadcast = flights.stream(
+            "/generate/stream", request.query, lambda b: stream_generate(request.query, b)
+        )
+        await broadcast.wait_started()
+    except httpx.RequestError:
+        release()
+        raise HTTPException(status_code=503, detail="RAG Service unavailable")
+    except Exception as e:
+        release()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def relay():
+        chunks = []
+        try:
+            async for chunk in broadcast.subscribe():
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            # Upstream broke mid-answer: abort our body too, the client must not take it as complete
+            log(f"Answer stream interrupted after {len(chunks)} chunks: {e}")
+            raise
+        finally:
+            release()
+        # Only a completed answer ends up in the history
+        await db.asave_message(request.session_id, "assistant", "".join(chunks))
+
+    # background: also releases the slot when the client leaves before the body starts
+    return StreamingResponse(relay(), media_type="text/plain; charset=utf-8", background=BackgroundTask(release))
 
 
 @app.get("/history/{session_id}")
-def get_chat_history(session_id: str):
+def get_chat_history(session_id: str, limit: int = HISTORY_PAGE_SIZE, before: str | None = None):
+    """
+    Newest `limit` messages older than `before` (chronological order).
+    `next_before` is the cursor for the previous page, None when there is nothing older.
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
     try:
-        return db.get_history(session_id)
+        messages = db.get_history(session_id, limit=limit, before=before)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    next_before = messages[0]["timestamp"] if len(messages) == limit else None
+    return {"messages": messages, "next_before": next_before}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics."""
+    return metrics_response()
+
+
+@app.get("/stats")
+def get_stats():
+    """Runtime statistics of the orchestrator components."""
+    return {"history_writes": db.stats(), "rag_client": rag.stats(), "single_flight": flights.stats(),
+            "admission": admission.stats()}
 
 
 @app.post("/ingest-s3")
 async def trigger_ingestion(request: IngestRequest):
-    print(f"Orchestrator received ingestion trigger for: {request.file_key}")
+    log(f"Orchestrator received ingestion trigger for: {request.file_key}")
     try:
-        async with httpx.AsyncClient(timeout=300.0) as client:  # Longer timeout for ingestion
-            response = await client.post(
-                f"{RAG_SERVICE_URL}/ingest-s3",
-                json=request.model_dump()
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await rag.request("POST", "/ingest-s3", INGEST_TIMEOUT, json=request.model_dump())
+        response.raise_for_status()
+        return response.json()
 
     except Exception as e:
-        print(f"Error forwarding to RAG: {e}")
+        log(f"Error forwarding to RAG: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/ingest-s3/batch")
+async def trigger_batch_ingestion(request: IngestBatchRequest):
+    log(f"Orchestrator received batch ingestion trigger for {len(request.files)} files")
+    try:
+        response = await rag.request("POST", "/ingest-s3/batch", INGEST_TIMEOUT, json=request.model_dump())
+    except Exception as e:
+        log(f"Error forwarding to RAG: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if response.status_code != 200:
+        # 400/413/503 from rag-service: the lambda needs the real status to decide whether to retry
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response.json()
+
+
+@app.get("/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    resp = await rag.request("GET", f"/jobs/{job_id}", FILES_TIMEOUT)
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code, detail="Job not found")
+    return resp.json()
+
+
 @app.get("/files")
-async def get_files():
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{RAG_SERVICE_URL}/files")
-        return resp.json()
+async def get_files(request: Request):
+    """Proxied document catalog: a 304 from rag-service reuses our copy, and our clients get the same ETag."""
+    headers = {"If-None-Match": files_cache["etag"]} if files_cache["etag"] else {}
+    resp = await rag.request("GET", "/files", FILES_TIMEOUT, headers=headers)
+    if resp.status_code == 200:
+        files_cache.update(etag=resp.headers.get("ETag"), body=resp.json())
+    elif resp.status_code != 304:
+        raise HTTPException(status_code=resp.status_code, detail="Error listing files")
+
+    etag = files_cache["etag"]
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(files_cache["body"], headers={"ETag": etag} if etag else None)
 
 
 @app.delete("/files/{filename}")
 async def delete_file(filename: str):
-    async with httpx.AsyncClient() as client:
-        resp = await client.delete(f"{RAG_SERVICE_URL}/files/{filename}")
-        if resp.status_code != 200:
-            raise HTTPException(status_code=resp.status_code, detail="Error deleting file")
-        return resp.json()
+    resp = await rag.request("DELETE", f"/files/{filename}", INGEST_TIMEOUT)
+    flights.bump_version()
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code, detail="Error deleting file")
+    return resp.json()
@@ -0,0 +1,92 @@
+import time
+import uuid
+from contextvars import ContextVar
+from fastapi import Response
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Set by RequestContextMiddleware, read by log() so every line of a request can be grepped together
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "orchestrator_http_request_seconds", "HTTP request latency", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+SAVE_MESSAGE_SECONDS = Histogram(
+    "orchestrator_save_message_seconds", "Time /query waits to hand a message to the history writer",
+    buckets=LATENCY_BUCKETS
+)
+HISTORY_FLUSH_SECONDS = Histogram(
+    "orchestrator_history_flush_seconds", "Latency of one batched write to the history repository",
+    buckets=LATENCY_BUCKETS
+)
+RAG_REQUEST_SECONDS = Histogram(
+    "orchestrator_rag_request_seconds", "rag-service call latency (until the response headers)", ["path"],
+    buckets=LATENCY_BUCKETS
+)
+RAG_POOL_WAIT_SECONDS = Histogram(
+    "orchestrator_rag_pool_wait_seconds", "Wait for a free connection slot to rag-service",
+    buckets=LATENCY_BUCKETS
+)
+SINGLE_FLIGHT_REQUESTS = Counter(
+    "orchestrator_single_flight_requests", "Queries by single-flight role (leader calls rag-service)",
+    ["endpoint", "role"]
+)
+COALESCING_RATIO = Gauge(
+    "orchestrator_coalescing_ratio", "Share of queries served by joining an identical in-flight call"
+)
+ADMISSION_REJECTIONS = Counter(
+    "orchestrator_admission_rejections", "Queries refused with 429", ["reason"]
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "orchestrator_admission_wait_seconds", "Time an admitted query waited for a slot", buckets=LATENCY_BUCKETS
+)
+
+
+def log(message: str):
+    print(f"[{request_id.get()}] {message}")
+
+
+class RequestContextMiddleware:
+    """
+    Pure ASGI middleware (streaming responses pass through untouched):
+    reuses the caller's X-Request-ID or creates one, echoes it in the
+    response and records the request latency per route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rid = dict(scope["headers"]).get(REQUEST_ID_HEADER.lower().encode(), b"").decode() or uuid.uuid4().hex
+        token = request_id.set(rid)
+        started = time.monotonic()
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), rid.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # Route template, not the raw path: /jobs/{job_id} must stay one series
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route.path if route else "unmatched", str(status["code"])
+            ).observe(time.monotonic() - started)
+            request_id.reset(token)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
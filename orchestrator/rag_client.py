@@ -0,0 +1,120 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import httpx
+from metrics import RAG_REQUEST_SECONDS, RAG_POOL_WAIT_SECONDS, REQUEST_ID_HEADER, request_id
+from constants import (
+    RAG_SERVICE_URL, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT, HTTP2_ENABLED
+)
+
+
+class RAGClient:
+    """
+    App-scoped httpx client towards rag-service: one keep-alive connection
+    pool for every endpoint instead of a new TCP connection per request.
+    Requests wait for one of `max_connections` slots, and the time spent
+    waiting is what we report as pool wait.
+    """
+
+    def __init__(self, base_url: str = RAG_SERVICE_URL,
+                 max_connections: int = HTTP_MAX_CONNECTIONS,
+                 max_keepalive: int = HTTP_MAX_KEEPALIVE,
+                 keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+                 http2: bool = HTTP2_ENABLED.lower() == "true"):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self._client = None
+        self._slots = None
+        self._stats = {"requests": 0, "in_flight": 0, "waiting": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+
+    async def start(self):
+        if self.http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("HTTP/2 requested but the 'h2' package is missing, using HTTP/1.1")
+                self.http2 = False
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+        self._slots = asyncio.Semaphore(self.max_connections)
+
+    async def stop(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def _slot(self):
+        started = time.monotonic()
+        self._stats["waiting"] += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._stats["waiting"] -= 1
+        wait_ms = 1000 * (time.monotonic() - started)
+        RAG_POOL_WAIT_SECONDS.observe(wait_ms / 1000)
+        self._stats["requests"] += 1
+        self._stats["total_wait_ms"] += wait_ms
+        self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+        self._stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            self._stats["in_flight"] -= 1
+            self._slots.release()
+
+    @staticmethod
+    def _timeout(seconds: float) -> httpx.Timeout:
+        return httpx.Timeout(seconds, connect=HTTP_CONNECT_TIMEOUT)
+
+    @staticmethod
+    def _headers(kwargs: dict) -> dict:
+        # Same request ID on both services, so their logs can be joined
+        return {REQUEST_ID_HEADER: request_id.get(), **kwargs.pop("headers", {})}
+
+    @staticmethod
+    def _route(path: str) -> str:
+        # /jobs/<id> and /files/<name> collapse to one label each
+        return "/" + path.strip("/").split("/")[0]
+
+    async def request(self, method: str, path: str, timeout: float, **kwargs) -> httpx.Response:
+        headers = self._headers(kwargs)
+        async with self._slot():
+            started = time.monotonic()
+            try:
+                return await self._client.request(
+                    method, path, timeout=self._timeout(timeout), headers=headers, **kwargs
+                )
+            finally:
+                RAG_REQUEST_SECONDS.labels(self._route(path)).observe(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def stream(self, method: str, path: str, timeout: float, **kwargs):
+        """Streaming response; the connection slot is held until the body is consumed."""
+        headers = self._headers(kwargs)
+        async with self._slot():
+            started = time.monotonic()
+            async with self._client.stream(
+                method, path, timeout=self._timeout(timeout), headers=headers, **kwargs
+            ) as response:
+                RAG_REQUEST_SECONDS.labels(self._route(path)).observe(time.monotonic() - started)
+                yield response
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        total_wait = stats.pop("total_wait_ms")
+        stats["avg_wait_ms"] = total_wait / stats["requests"] if stats["requests"] else 0.0
+        stats["max_connections"] = self.max_connections
+        stats["http2"] = self.http2
+        return stats
@@ -0,0 +1,153 @@
+import asyncio
+from metrics import SINGLE_FLIGHT_REQUESTS, COALESCING_RATIO, log
+from constants import SINGLE_FLIGHT_ENABLED, SINGLE_FLIGHT_BY_CORPUS_VERSION
+
+CORPUS_VERSION_HEADER = "X-Corpus-Version"
+
+
+class Broadcast:
+    """
+    One upstream answer stream fanned out to any number of subscribers.
+    Chunks are kept, so a late subscriber replays the answer from the start.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.started = asyncio.get_running_loop().create_future()  # resolved when upstream answered 200
+        self._changed = asyncio.Condition()
+
+    def start(self):
+        if not self.started.done():
+            self.started.set_result(True)
+
+    async def publish(self, chunk: str):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def close(self, error: Exception | None = None):
+        if not self.started.done():
+            self.started.set_exception(error or RuntimeError("Upstream stream closed before starting"))
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    async def wait_started(self):
+        await asyncio.shield(self.started)
+
+    async def subscribe(self):
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.chunks) > sent or self.done)
+                new, done, error = self.chunks[sent:], self.done, self.error
+            sent += len(new)
+            for chunk in new:
+                yield chunk
+            if done:
+                if error:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight queries: the first one (leader) calls
+    rag-service in its own task, the duplicates that arrive meanwhile
+    (followers) wait on that task and get the same answer. The key is the
+    normalized query text, plus the last corpus version seen from rag-service
+    so that a query sent after a re-ingestion doesn't join an older call.
+    """
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED.lower() == "true",
+                 by_corpus_version: bool = SINGLE_FLIGHT_BY_CORPUS_VERSION.lower() == "true"):
+        self.enabled = enabled
+        self.by_corpus_version = by_corpus_version
+        self.corpus_version = None
+        self._inflight = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def key(self, endpoint: str, query: str):
+        version = self.corpus_version if self.by_corpus_version else None
+        return endpoint, version, self.normalize(query)
+
+    def observe_version(self, headers):
+        """Called with every rag-service response, keeps the newest corpus version."""
+        version = headers.get(CORPUS_VERSION_HEADER)
+        if version is not None:
+            self.corpus_version = version
+
+    def bump_version(self):
+        # The corpus changed through us (e.g. a delete): never join calls started before it
+        self.corpus_version = f"{self.corpus_version}+"
+
+    def _record(self, endpoint: str, role: str):
+        self._stats[role + "s"] += 1
+        SINGLE_FLIGHT_REQUESTS.labels(endpoint, role).inc()
+        COALESCING_RATIO.set(self.ratio())
+
+    def ratio(self) -> float:
+        total = self._stats["leaders"] + self._stats["followers"]
+        return self._stats["followers"] / total if total else 0.0
+
+    def _join_or_start(self, endpoint: str, query: str, start, broadcast: Broadcast | None = None):
+        """
+        (task, broadcast) of the in-flight call for this query. When there is
+        none, start() is run in a new task and `broadcast` is shared with it.
+        """
+        key = self.key(endpoint, query)
+        flight = self._inflight.get(key) if self.enabled else None
+        if flight is not None:
+            self._record(endpoint, "follower")
+            log(f"Joining in-flight call for: {query}")
+            return flight
+
+        self._record(endpoint, "leader")
+        # Own task: a leader whose client disconnects doesn't cancel the followers
+        task = asyncio.create_task(start())
+        if not self.enabled:
+            return task, broadcast
+        self._inflight[key] = (task, broadcast)
+
+        def finished(t):
+            if self._inflight.get(key, (None,))[0] is t:
+                del self._inflight[key]
+            if not t.cancelled():
+                t.exception()  # retrieved here, even if every waiter went away
+
+        task.add_done_callback(finished)
+        return task, broadcast
+
+    async def do(self, endpoint: str, query: str, call):
+        """Result of `await call()`, shared by all identical concurrent queries."""
+        task, _ = self._join_or_start(endpoint, query, call)
+        return await asyncio.shield(task)
+
+    def stream(self, endpoint: str, query: str, produce) -> Broadcast:
+        """
+        Broadcast of the answer stream. `produce(broadcast)` reads upstream and
+        publishes to it; only the leader runs it.
+        """
+        broadcast = Broadcast()
+
+        async def run():
+            try:
+                await produce(broadcast)
+            except Exception as e:
+                await broadcast.close(e)
+                return
+            await broadcast.close()
+
+        _, shared = self._join_or_start(endpoint, query, run, broadcast)
+        return shared
+
+    def stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._inflight), "coalescing_ratio": self.ratio(),
+                "corpus_version": self.corpus_version}
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from database import ChatHistoryRepository
+from metrics import SAVE_MESSAGE_SECONDS, HISTORY_FLUSH_SECONDS
+from constants import (
+    WRITE_BEHIND_QUEUE_SIZE, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_MAX_RETRIES
+)
+
+
+class WriteBehindRepository(ChatHistoryRepository):
+    """
+    Keeps history writes off the request path: messages go into a bounded
+    asyncio queue and a background task stores them in batches through the
+    wrapped repository. Reads merge the messages of the session that are
+    still waiting to be flushed, so a user always sees their own writes.
+    """
+
+    def __init__(self, repository: ChatHistoryRepository,
+                 queue_size: int = WRITE_BEHIND_QUEUE_SIZE,
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_retries: int = WRITE_BEHIND_MAX_RETRIES):
+        self.repository = repository
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = None
+        self._task = None
+        # session_id -> messages accepted but not flushed yet (read from the threadpool too)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._stats = {"flushed": 0, "batches": 0, "errors": 0, "dropped": 0,
+                       "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0}
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        """Flushes everything still queued, called on shutdown."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=30)
+        except asyncio.TimeoutError:
+            print(f"History write-behind: {self._queue.qsize()} messages not flushed on shutdown")
+        self._task.cancel()
+        self._task = None
+        print(f"History write-behind stopped, {self._stats['flushed']} messages flushed")
+
+    async def asave_message(self, session_id: str, role: str, content: str):
+        started = time.monotonic()
+        message = {
+            "session_id": session_id,
+            "role": role,
+            "content": content,
+            # Taken now, so the order of the conversation doesn't depend on the flush
+            "timestamp": datetime.now().isoformat()
+        }
+        if self._queue is None:
+            await asyncio.to_thread(self.repository.save_messages, [message])
+        else:
+            with self._pending_lock:
+                self._pending.setdefault(session_id, []).append(message)
+            # Waits only when the queue is full (backpressure)
+            await self._queue.put(message)
+        SAVE_MESSAGE_SECONDS.observe(time.monotonic() - started)
+
+    def save_message(self, session_id: str, role: str, content: str):
+        self.repository.save_message(session_id, role, content)
+
+    def save_messages(self, messages: list[dict]):
+        self.repository.save_messages(messages)
+
+    def get_history(self, session_id: str, limit: int | None = None, before: str | None = None):
+        stored = self.repository.get_history(session_id, limit=limit, before=before)
+        with self._pending_lock:
+            pending = [
+                {"role": m["role"], "content": m["content"], "timestamp": m["timestamp"]}
+                for m in self._pending.get(session_id, [])
+                if not before or m["timestamp"] < before
+            ]
+        if not pending:
+            return stored
+        # A message may have been flushed between the two reads
+        seen = {(m["timestamp"], m["role"]) for m in stored}
+        merged = stored + [m for m in pending if (m["timestamp"], m["role"]) not in seen]
+        merged.sort(key=lambda m: m["timestamp"])
+        return merged[-limit:] if limit else merged
+
+    async def _next_batch(self) -> list[dict]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flusher(self):
+        while True:
+            batch = await self._next_batch()
+            await self._flush(batch)
+            with self._pending_lock:
+                for msg in batch:
+                    session = self._pending.get(msg["session_id"], [])
+                    if msg in session:
+                        session.remove(msg)
+                    if not session:
+                        self._pending.pop(msg["session_id"], None)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch: list[dict]):
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                await asyncio.to_thread(self.repository.save_messages, batch)
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"Error flushing {len(batch)} history messages (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(min(2 ** attempt * 0.1, 5))
+                continue
+            elapsed_ms = 1000 * (time.monotonic() - started)
+            HISTORY_FLUSH_SECONDS.observe(elapsed_ms / 1000)
+            self._stats["flushed"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["last_flush_ms"] = elapsed_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+            self._stats["total_flush_ms"] += elapsed_ms
+            return
+        self._stats["dropped"] += len(batch)
+        print(f"Dropping {len(batch)} history messages after {self.max_retries + 1} attempts")
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize() if self._queue else 0
+        stats["queue_size"] = self.queue_size
+        stats["avg_flush_ms"] = stats.pop("total_flush_ms") / stats["batches"] if stats["batches"] else 0.0
+        with self._pending_lock:
+            stats["pending_sessions"] = len(self._pending)
+        return stats
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from constants import CATALOG_PATH, MANIFEST_DIR, DATA_DIR
+
+
+def file_hash(path: str) -> str | None:
+    """sha256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+class DocumentCatalog:
+    """
+    What is indexed, per source file: its chunk IDs (with content hash and
+    position, used by ingestion to diff a re-upload), chunk and page count,
+    byte size, file hash and ingest time. Every change bumps a version,
+    which is the ETag of the /files listing and the collection version
+    seen by every worker sharing the database.
+    """
+
+    def __init__(self, filepath: str = CATALOG_PATH, legacy_manifests: str = MANIFEST_DIR):
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                source TEXT PRIMARY KEY, chunk_count INTEGER, page_count INTEGER,
+                byte_size INTEGER, file_hash TEXT, ingested_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY, source TEXT NOT NULL, content_hash TEXT, chunk_index INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0');
+            """
+        )
+        # Random per database: a recreated catalog never reuses an old ETag
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('instance', ?)", (uuid.uuid4().hex[:8],))
+        self._conn.commit()
+        self._migrate_manifests(legacy_manifests)
+
+    def _migrate_manifests(self, manifest_dir: str):
+        """One-time import of the per-file JSON manifests written by older versions."""
+        if not manifest_dir or not os.path.isdir(manifest_dir):
+            return
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_manifests'").fetchone():
+                return
+            imported = 0
+            for name in os.listdir(manifest_dir):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(manifest_dir, name), "r") as f:
+                        manifest = json.load(f)
+                except Exception as e:
+                    print(f"⚠️ Unreadable manifest {name}, skipping: {e}")
+                    continue
+                self._write_document(manifest["source"], manifest["chunks"], None, manifest.get("updated_at"))
+                imported += 1
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_manifests', ?)", (str(time.time()),))
+            self._bump()
+        if imported:
+            print(f"Migrated {imported} manifests from {manifest_dir} to the catalog")
+
+    def backfill_from_collection(self, collection, page_size: int = 1000) -> int:
+        """
+        One-time import of the sources found in Chroma but not in the catalog
+        (indexed before it existed), so /files lists them and deletes go by ID.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'backfilled_collection'").fetchone():
+                return 0
+        known = {document["source"] for document in self.list_documents()}
+        found = {}
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            for cid, metadata in zip(page["ids"], page["metadatas"]):
+                source = (metadata or {}).get("source")
+                if source and source not in known:
+                    found.setdefault(source, {})[cid] = {
+                        "hash": metadata.get("content_hash"), "chunk_index": metadata.get("chunk_index")
+                    }
+            offset += len(page["ids"])
+        with self._lock, self._conn:
+            for source, chunks in found.items():
+                self._write_document(source, chunks, None, None)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('backfilled_collection', ?)", (str(time.time()),)
+            )
+            if found:
+                self._bump()
+        if found:
+            print(f"Backfilled {len(found)} documents from the Chroma collection into the catalog")
+        return len(found)
+
+    def _bump(self):
+        self._conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+
+    def bump_version(self):
+        with self._lock, self._conn:
+            self._bump()
+
+    def version(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+
+    def _write_document(self, source: str, chunks: dict, pages: int | None, ingested_at: float | None):
+        path = os.path.join(DATA_DIR, source)
+        size = os.path.getsize(path) if os.path.exists(path) else None
+        self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+            [(cid, source, c["hash"], c["chunk_index"]) for cid, c in chunks.items()]
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+            (source, len(chunks), pages, size, file_hash(path), ingested_at or time.time())
+        )
+
+    def get_chunks(self, source: str) -> dict | None:
+        """{chunk_id: {"hash": ..., "chunk_index": ...}} of the last ingestion, None if never ingested."""
+        with self._lock:
+            if not self._conn.execute("SELECT 1 FROM documents WHERE source = ?", (source,)).fetchone():
+                return None
+            rows = self._conn.execute(
+                "SELECT chunk_id, content_hash, chunk_index FROM chunks WHERE source = ?", (source,)
+            ).fetchall()
+        return {cid: {"hash": text_hash, "chunk_index": index} for cid, text_hash, index in rows}
+
+    def chunk_ids(self, source: str) -> list[str] | None:
+        chunks = self.get_chunks(source)
+        return None if chunks is None else list(chunks)
+
+    def save_document(self, source: str, chunks: dict, pages: int | None = None):
+        with self._lock, self._conn:
+            self._write_document(source, chunks, pages, None)
+            self._bump()
+
+    def delete_document(self, source: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+            self._bump()
+
+    def list_documents(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, chunk_count, page_count, byte_size, file_hash, ingested_at "
+                "FROM documents ORDER BY source"
+            ).fetchall()
+        keys = ("source", "chunks", "pages", "bytes", "file_hash", "ingested_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def etag(self) -> str:
+        with self._lock:
+            meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        return f'"{meta["instance"]}-{meta["version"]}"'
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> DocumentCatalog:
+    """Process-wide catalog shared by the API and the ingestion pipeline."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = DocumentCatalog()
+        return _catalog
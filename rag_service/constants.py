@@ -12,3 +12,88 @@ CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST")
 CHROMA_SERVER_PORT = os.getenv("CHROMA_SERVER_PORT")
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+
+# long-lived Chroma connection used by the Retriever
+CHROMA_MAX_CONCURRENCY = int(os.getenv("CHROMA_MAX_CONCURRENCY", "8"))
+CHROMA_HEALTHCHECK_INTERVAL = float(os.getenv("CHROMA_HEALTHCHECK_INTERVAL", "30"))
+
+# micro-batching of query embeddings
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "16"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+# async /generate path
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+# semantic answer cache
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true")
+SEMANTIC_CACHE_BACKEND = os.getenv("SEMANTIC_CACHE_BACKEND", "memory")  # "memory" or "sqlite"
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "/app/cache/semantic_cache.db")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+SEMANTIC_CACHE_MAX_BYTES = int(os.getenv("SEMANTIC_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# exact-match caches in the Retriever
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+
+# ingestion
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "3000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "1"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "32"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+# parallel S3 downloads of a batch job (each one streams to disk)
+S3_DOWNLOAD_CONCURRENCY = int(os.getenv("S3_DOWNLOAD_CONCURRENCY", "8"))
+INGEST_BATCH_MAX_FILES = int(os.getenv("INGEST_BATCH_MAX_FILES", "100"))
+# per-file chunk lists and document metadata, see catalog.py
+CATALOG_PATH = os.getenv("CATALOG_PATH", "/app/catalog/catalog.db")
+# legacy per-file JSON manifests, imported once into the catalog
+MANIFEST_DIR = os.getenv("MANIFEST_DIR", "/app/manifests")
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "256"))
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "1"))
+PAGES_PER_TASK = int(os.getenv("PAGES_PER_TASK", "16"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+PIPELINE_FLUSH_INTERVAL = float(os.getenv("PIPELINE_FLUSH_INTERVAL", "0.5"))
+
+# context assembly between retrieval and generation
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "false")  # extractive, sentence level
+CHARS_PER_TOKEN = int(os.getenv("CHARS_PER_TOKEN", "4"))
+
+# retrieval backend: "chroma" (HTTP round trip) or "mmap" (in-process snapshot of the collection)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "/app/vector_index")
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "int8")  # "int8", "float16" or "none"
+VECTOR_INDEX_RESCORE_FACTOR = int(os.getenv("VECTOR_INDEX_RESCORE_FACTOR", "8"))
+VECTOR_INDEX_REFRESH_INTERVAL = float(os.getenv("VECTOR_INDEX_REFRESH_INTERVAL", "5"))
+VECTOR_INDEX_EXPORT_PAGE = int(os.getenv("VECTOR_INDEX_EXPORT_PAGE", "5000"))
+
+# embedding backend: "torch" (HuggingFace/sentence-transformers) or "onnx"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "/app/models/all-MiniLM-L6-v2-onnx")
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true")
+EMBEDDING_INTRA_OP_THREADS = int(os.getenv("EMBEDDING_INTRA_OP_THREADS", "0"))  # 0 = runtime default
+EMBEDDING_PARITY_TOLERANCE = float(os.getenv("EMBEDDING_PARITY_TOLERANCE", "0.02"))
+
+# LLM backend: "gemini" or "stub" (deterministic fake for benchmarks and tests, no API calls)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "800"))  # median of the full answer
+STUB_LLM_LATENCY_SIGMA = float(os.getenv("STUB_LLM_LATENCY_SIGMA", "0.3"))  # lognormal spread, 0 = fixed
+STUB_LLM_FIRST_TOKEN_MS = float(os.getenv("STUB_LLM_FIRST_TOKEN_MS", "200"))
+STUB_LLM_ANSWER_TOKENS = int(os.getenv("STUB_LLM_ANSWER_TOKENS", "120"))
+STUB_LLM_SEED = int(os.getenv("STUB_LLM_SEED", "0"))
+STUB_LLM_ERROR_RATE = float(os.getenv("STUB_LLM_ERROR_RATE", "0"))  # share of calls failing, to exercise retries
+
+# resilience of the LLM calls
+# whole call, retries included; for streams only up to the first chunk
+LLM_DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "20"))
+LLM_STREAM_IDLE_S = float(os.getenv("LLM_STREAM_IDLE_S", "10"))  # max gap between two streamed chunks
+LLM_HEDGE_AFTER_MS = os.getenv("LLM_HEDGE_AFTER_MS", "0")  # "0" = off, a number, or "auto" (observed p95)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF_MS = float(os.getenv("LLM_RETRY_BACKOFF_MS", "200"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # consecutive failed calls
+BREAKER_RESET_TIMEOUT_S = float(os.getenv("BREAKER_RESET_TIMEOUT_S", "30"))
+DEGRADED_ANSWER_CHARS = int(os.getenv("DEGRADED_ANSWER_CHARS", "1500"))
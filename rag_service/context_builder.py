@@ -0,0 +1,142 @@
+import re
+import math
+import threading
+import numpy as np
+from constants import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_COMPRESSION, CHARS_PER_TOKEN, CHUNK_OVERLAP
+)
+
+SEPARATOR = "\n\n---\n\n"
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def overlap_length(left: str, right: str, max_overlap: int, min_overlap: int = 20) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    for size in range(min(max_overlap, len(left), len(right)), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class ContextBuilder:
+    """
+    Turns the retrieved chunks into the prompt context:
+    1. chunks of the same source with consecutive chunk_index are merged,
+       dropping the text repeated by the splitter overlap;
+    2. if enabled and the passages exceed the budget, only the sentences
+       most similar to the query are kept (in their original order);
+    3. passages are packed, most relevant first, into the token budget.
+    """
+
+    def __init__(self, embedding_model,
+                 token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 compression: bool = CONTEXT_COMPRESSION.lower() == "true",
+                 max_overlap: int = 2 * CHUNK_OVERLAP):
+        self.embedding_model = embedding_model
+        self.token_budget = token_budget
+        self.compression = compression
+        self.max_overlap = max_overlap
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._tokens_in = 0
+        self._tokens_out = 0
+
+    def merge(self, docs) -> list[str]:
+        """Passages in relevance order of their best chunk, adjacent chunks merged."""
+        groups = {}
+        for rank, doc in enumerate(docs):
+            source = doc.metadata.get("source", f"#{rank}")
+            groups.setdefault(source, {}).setdefault(doc.metadata.get("chunk_index", rank), (rank, doc.page_content))
+
+        runs = []  # (best rank, merged text)
+        for chunks in groups.values():
+            run_rank, run_text, last_index = None, None, None
+            for index in sorted(chunks):
+                rank, text = chunks[index]
+                if run_text is not None and index == last_index + 1:
+                    run_text += text[overlap_length(run_text, text, self.max_overlap):]
+                    run_rank = min(run_rank, rank)
+                else:
+                    if run_text is not None:
+                        runs.append((run_rank, run_text))
+                    run_rank, run_text = rank, text
+                last_index = index
+            runs.append((run_rank, run_text))
+        # pack() keeps the head of the list when the budget runs out
+        return [text for _, text in sorted(runs, key=lambda run: run[0])]
+
+    def compress(self, query_embedding, passages: list[str], budget: int) -> list[str]:
+        sentences = [
+            (p, s) for p, passage in enumerate(passages)
+            for s in _SENTENCE_SPLIT.split(passage) if s.strip()
+        ]
+        if not sentences:
+            return passages
+        # One batched forward pass, then a single matmul for all the scores
+        vectors = np.asarray(self.embedding_model.embed_documents([s for _, s in sentences]), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = vectors @ (query / (np.linalg.norm(query) + 1e-12))
+
+        keep, used = set(), 0
+        for i in np.argsort(-scores):
+            cost = estimate_tokens(sentences[i][1])
+            if used + cost > budget:
+                continue
+            keep.add(int(i))
+            used += cost
+
+        compressed = [[] for _ in passages]
+        for i, (p, sentence) in enumerate(sentences):
+            if i in keep:
+                compressed[p].append(sentence)
+        return [" ".join(kept) for kept in compressed if kept]
+
+    def pack(self, passages: list[str], budget: int) -> str:
+        packed, used = [], 0
+        for passage in passages:
+            remaining = budget - used - (estimate_tokens(SEPARATOR) if packed else 0)
+            if remaining <= 0:
+                break
+            if estimate_tokens(passage) > remaining:
+                # Cut the last passage at a sentence boundary if there is one
+                cut = passage[:remaining * CHARS_PER_TOKEN]
+                boundary = max(cut.rfind(". "), cut.rfind("\n"))
+                passage = cut[:boundary + 1] if boundary > 0 else cut
+                if not passage.strip():
+                    break
+            packed.append(passage)
+            used += estimate_tokens(passage) + (estimate_tokens(SEPARATOR) if len(packed) > 1 else 0)
+        return SEPARATOR.join(packed)
+
+    def build(self, query_embedding, docs) -> tuple[str, int]:
+        """Returns the context and the number of tokens saved compared to plain concatenation."""
+        naive_tokens = estimate_tokens(SEPARATOR.join(doc.page_content for doc in docs))
+        passages = self.merge(docs)
+        if self.compression and estimate_tokens(SEPARATOR.join(passages)) > self.token_budget:
+            passages = self.compress(query_embedding, passages, self.token_budget)
+        context = self.pack(passages, self.token_budget)
+
+        saved = naive_tokens - estimate_tokens(context)
+        with self._lock:
+            self._requests += 1
+            self._tokens_in += naive_tokens
+            self._tokens_out += estimate_tokens(context)
+        print(f"✂️ Context: {naive_tokens} -> {naive_tokens - saved} tokens ({saved} saved)")
+        return context, saved
+
+    def stats(self) -> dict:
+        with self._lock:
+            saved = self._tokens_in - self._tokens_out
+            return {
+                "token_budget": self.token_budget,
+                "compression": self.compression,
+                "requests": self._requests,
+                "tokens_saved": saved,
+                "avg_tokens_saved": saved / self._requests if self._requests else 0.0,
+                "saved_ratio": saved / self._tokens_in if self._tokens_in else 0.0,
+            }
@@ -0,0 +1,107 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+from constants import EMBED_BATCH_MAX_SIZE, EMBED_BATCH_MAX_WAIT_MS
+
+
+class BatchingEmbedder(Embeddings):
+    """
+    Micro-batcher in front of an embedding model. Queries that arrive within
+    max_wait_ms of each other (or until max_batch_size is reached) are embedded
+    with a single embed_documents call, each caller gets back its own vector.
+    """
+
+    def __init__(self, model: Embeddings,
+                 max_batch_size: int = EMBED_BATCH_MAX_SIZE,
+                 max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._queries = 0
+        self._max_batch_seen = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.submit(text).result()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        # The caller awaits the batch without holding a thread
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        # Document batches are already batched, no need to queue them
+        return self.model.embed_documents(texts)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                self._run_batch(self._collect())
+            except Exception as e:
+                # Never let one bad batch end the thread: every later query would hang
+                print(f"⚠️ Embedding batcher error: {e}")
+
+    def _run_batch(self, batch):
+        # Callers that went away (disconnect, timeout) cancelled their future: skip them
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.monotonic()
+        texts = [text for text, _, _ in batch]
+        try:
+            vectors = self.model.embed_documents(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), vector in zip(batch, vectors):
+            future.set_result(vector)
+        self._record(len(batch), [started - enqueued for _, _, enqueued in batch])
+
+    def _record(self, size: int, waits: list[float]):
+        with self._stats_lock:
+            self._batches += 1
+            self._queries += size
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._total_wait += sum(waits)
+            self._max_wait_seen = max(self._max_wait_seen, max(waits))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "queries": self._queries,
+                "avg_batch_size": self._queries / self._batches if self._batches else 0.0,
+                "max_batch_size_seen": self._max_batch_seen,
+                "avg_queue_wait_ms": 1000 * self._total_wait / self._queries if self._queries else 0.0,
+                "max_queue_wait_ms": 1000 * self._max_wait_seen,
+                "queue_depth": self._queue.qsize(),
+            }
@@ -0,0 +1,194 @@
+import os
+import json
+import argparse
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from constants import (
+    EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, ONNX_MODEL_DIR, ONNX_QUANTIZED,
+    EMBEDDING_INTRA_OP_THREADS, EMBEDDING_PARITY_TOLERANCE
+)
+
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+PARITY_FILE = "parity.json"  # written at export time: {model file: {"max_cosine_distance", "tolerance", "ok"}}
+MAX_SEQ_LENGTH = 256  # same truncation as sentence-transformers for all-MiniLM-L6-v2
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime: same tokenizer, mean pooling and
+    L2 normalization as the sentence-transformers pipeline, without torch.
+    The model files are produced once with `python embeddings.py --export`
+    (run by the Dockerfile), which also records their parity with PyTorch.
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR,
+                 quantized: bool = ONNX_QUANTIZED.lower() == "true",
+                 intra_op_threads: int = EMBEDDING_INTRA_OP_THREADS,
+                 batch_size: int = 32):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_file = ONNX_INT8_FILE if quantized else ONNX_FP32_FILE
+        model_path = os.path.join(model_dir, self.model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found, run `python embeddings.py --export` first")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.batch_size = batch_size
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        print(f"Loaded ONNX embedding model {model_path}")
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feed = {
+            "input_ids": np.asarray([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.asarray([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.asarray([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+        mask = feed["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+def get_torch_embeddings():
+    # Imported here: the ONNX backend doesn't need to pay for torch at all
+    from langchain_huggingface import HuggingFaceEmbeddings
+    if EMBEDDING_INTRA_OP_THREADS > 0:
+        import torch
+        torch.set_num_threads(EMBEDDING_INTRA_OP_THREADS)
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def get_embedding_model() -> Embeddings:
+    """
+    Factory: embedding backend selected by EMBEDDING_BACKEND ("torch" or "onnx").
+    An ONNX model that fails to load, or whose export-time parity check with
+    PyTorch is missing or failed, falls back to PyTorch.
+    """
+    if EMBEDDING_BACKEND.lower() != "onnx":
+        return get_torch_embeddings()
+    try:
+        onnx = OnnxEmbeddings()
+    except Exception as e:
+        print(f"⚠️ ONNX embeddings unavailable ({e}), falling back to PyTorch")
+        return get_torch_embeddings()
+    parity = load_parity().get(onnx.model_file)
+    if not parity or not parity["ok"]:
+        print(f"❌ {onnx.model_file} has no passing parity check ({parity}), using the PyTorch backend")
+        return get_torch_embeddings()
+    return onnx
+
+
+def export_onnx(model_dir: str = ONNX_MODEL_DIR, quantize: bool = True):
+    """Exports the HuggingFace model (and its tokenizer) to ONNX, optionally with dynamic int8 weights."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    hub_name = f"sentence-transformers/{EMBEDDING_MODEL_NAME}"
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(hub_name)
+    tokenizer.save_pretrained(model_dir)
+    model = AutoModel.from_pretrained(hub_name).eval()
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    axes = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(model_dir, ONNX_FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "token_type_ids": axes,
+                          "last_hidden_state": axes},
+            opset_version=14,
+        )
+    print(f"✅ Exported {fp32_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(model_dir, ONNX_INT8_FILE)
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"✅ Quantized {int8_path}")
+
+
+PARITY_SENTENCES = [
+    "What is the difference between a process and a thread?",
+    "Explain the CAP theorem with an example.",
+    "Gradient descent updates the weights in the opposite direction of the gradient.",
+    "## Chapter 3\n\nThe TCP three-way handshake: SYN, SYN-ACK, ACK.",
+    "Quali sono le proprietà ACID di una transazione?",
+]
+
+
+def max_cosine_distance(candidate: Embeddings, reference: Embeddings) -> float:
+    expected = np.asarray(reference.embed_documents(PARITY_SENTENCES), dtype=np.float32)
+    vectors = np.asarray(candidate.embed_documents(PARITY_SENTENCES), dtype=np.float32)
+    cosine = (expected * vectors).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(vectors, axis=1)
+    )
+    return float(1.0 - cosine.min())
+
+
+def verify_parity(model_dir: str = ONNX_MODEL_DIR, tolerance: float = EMBEDDING_PARITY_TOLERANCE) -> bool:
+    """
+    Compares the exported ONNX models with the PyTorch one and saves the result
+    next to them: vectors of existing collections stay valid only if the cosine
+    distance stays within tolerance. Runs at export time, never at startup.
+    """
+    reference = get_torch_embeddings()
+    results = {}
+    for model_file, quantized in ((ONNX_FP32_FILE, False), (ONNX_INT8_FILE, True)):
+        if not os.path.exists(os.path.join(model_dir, model_file)):
+            continue
+        worst = max_cosine_distance(OnnxEmbeddings(model_dir, quantized=quantized), reference)
+        results[model_file] = {"max_cosine_distance": worst, "tolerance": tolerance, "ok": worst <= tolerance}
+        print(f"{model_file}: max cosine distance vs PyTorch {worst:.5f} (tolerance {tolerance})")
+    with open(os.path.join(model_dir, PARITY_FILE), "w") as f:
+        json.dump(results, f, indent=2)
+    return bool(results) and all(result["ok"] for result in results.values())
+
+
+def load_parity(model_dir: str = ONNX_MODEL_DIR) -> dict:
+    try:
+        with open(os.path.join(model_dir, PARITY_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--export', action='store_true', help='Export the model to ONNX and check its parity')
+    parser.add_argument('--no-quantize', action='store_true', help='Skip the int8 dynamic quantization')
+    parser.add_argument('--verify', action='store_true', help='Only re-check the ONNX vectors against PyTorch')
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx(quantize=not args.no_quantize)
+    if args.export or args.verify:
+        # The result is saved in PARITY_FILE either way; a failing model makes the service use PyTorch
+        ok = verify_parity()
+        print("✅ Parity OK" if ok else "❌ ONNX vectors diverge from PyTorch")
+        exit(0 if ok or args.export else 1)
@@ -1,19 +1,34 @@
 import os
+import asyncio
+import time
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
+from context_builder import estimate_tokens
+from resilience import ResilientLLM
+from metrics import LLM_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS, LLM_DEGRADED, log
+from constants import LLM_MAX_CONCURRENCY, LLM_BACKEND, DEGRADED_ANSWER_CHARS
 
 
 class Generator:
     def __init__(self):
         self._LLM_MODEL_NAME = "gemini-2.5-flash"
         load_dotenv()
-        if "GOOGLE_API_KEY" not in os.environ:
-            print("Error: GOOGLE_API_KEY not found in .env file.")
-            exit()
+        if LLM_BACKEND.lower() == "stub":
+            from stub_llm import StubLLM
+            print("Loading LLM: stub (no API calls)")
+            self.llm = StubLLM()
+        else:
+            if "GOOGLE_API_KEY" not in os.environ:
+                print("Error: GOOGLE_API_KEY not found in .env file.")
+                exit()
 
-        print(f"Loading LLM: {self._LLM_MODEL_NAME}")
-        self.llm = ChatGoogleGenerativeAI(model=self._LLM_MODEL_NAME)
+            print(f"Loading LLM: {self._LLM_MODEL_NAME}")
+            self.llm = ChatGoogleGenerativeAI(model=self._LLM_MODEL_NAME)
+        # Deadline, hedging, retries and circuit breaker around the async calls
+        self.resilient_llm = ResilientLLM(self.llm)
+        # Caps in-flight LLM calls, a slow upstream can't pile up unbounded work
+        self.llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
 
         self.prompt_template = ChatPromptTemplate.from_template(
             """
@@ -32,11 +47,58 @@ class Generator:
             """
         )
 
-    def generate_answer(self, query: str, context: str) -> str:
-        formatted_prompt = self.prompt_template.format(
+    def _format_prompt(self, query: str, context: str) -> str:
+        return self.prompt_template.format(
             context=context,
             question=query
         )
-        print("Generating answer...")
-        response = self.llm.invoke(formatted_prompt)
+
+    @staticmethod
+    def _record_tokens(message, prompt: str, answer: str):
+        # Provider counts when Gemini reports them, our estimate otherwise
+        usage = getattr(message, "usage_metadata", None) or {}
+        LLM_TOKENS.labels("prompt").observe(usage.get("input_tokens") or estimate_tokens(prompt))
+        LLM_TOKENS.labels("completion").observe(usage.get("output_tokens") or estimate_tokens(answer))
+
+    async def astream_answer(self, query: str, context: str):
+        """Yields the answer token chunks as the LLM produces them."""
+        formatted_prompt = self._format_prompt(query, context)
+        async with self.llm_slots:
+            log("Streaming answer...")
+            started = time.monotonic()
+            first_token = True
+            message = None  # chunks add up, usage_metadata included
+            async for chunk in self.resilient_llm.astream(formatted_prompt):
+                message = chunk if message is None else message + chunk
+                if chunk.content:
+                    if first_token:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.monotonic() - started)
+                        first_token = False
+                    yield chunk.content
+            LLM_SECONDS.labels("stream").observe(time.monotonic() - started)
+        if message is not None:
+            self._record_tokens(message, formatted_prompt, message.content)
+
+    async def agenerate_answer(self, query: str, context: str) -> str:
+        formatted_prompt = self._format_prompt(query, context)
+        async with self.llm_slots:
+            log("Generating answer...")
+            started = time.monotonic()
+            response = await self.resilient_llm.ainvoke(formatted_prompt)
+            LLM_SECONDS.labels("invoke").observe(time.monotonic() - started)
+        self._record_tokens(response, formatted_prompt, response.content)
         return response.content
+
+    @staticmethod
+    def degraded_answer(context: str, reason: str) -> str:
+        """Fast fallback while the LLM is unavailable: the best passages, verbatim."""
+        LLM_DEGRADED.labels(reason).inc()
+        if not context:
+            return "⚠️ The language model is temporarily unavailable, please retry shortly."
+        excerpt = context[:DEGRADED_ANSWER_CHARS]
+        if len(context) > DEGRADED_ANSWER_CHARS:
+            excerpt = excerpt.rsplit(" ", 1)[0] + " …"
+        return (
+            "⚠️ The language model is temporarily unavailable. "
+            "These are the most relevant passages from your documents:\n\n" + excerpt
+        )
@@ -1,98 +1,427 @@
 import os
+import json
+import time
+import queue
+import hashlib
 import argparse
-import chromadb
-from langchain_huggingface import HuggingFaceEmbeddings
-import pymupdf4llm as pymu
-from langchain_chroma import Chroma
+import threading
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from pdf_parser import parse_files
+from catalog import get_catalog
 from constants import (
-    DATA_DIR, CHROMA_DIR, EMBEDDING_MODEL_NAME, COLLECTION_NAME,
-    CHROMA_SERVER_HOST, CHROMA_SERVER_PORT
+    DATA_DIR, CHUNK_SIZE, CHUNK_OVERLAP, UPSERT_BATCH_SIZE, INGEST_PARSE_WORKERS,
+    EMBED_BATCH_SIZE, PIPELINE_QUEUE_SIZE, PIPELINE_FLUSH_INTERVAL
 )
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--size', type=int, default=3000, help='Size of each text chunk')
-parser.add_argument('--overlap', type=int, default=200, help='Size of each text chunk overlap')
-parser.add_argument('--file', type=str, default=None, help="Specific file to process (optional)")
-args = parser.parse_args()
-
-print("Initializing embedding function...")
-embedding_function = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-
-print(f"Loading {args.file if args.file else 'all PDFs'} from {DATA_DIR}...")
-
-files_to_process = []
-if args.file:
-    # Se c'è l'argomento, processiamo SOLO questo file
-    file_path = os.path.join(DATA_DIR, args.file)
-    if os.path.exists(file_path):
-        files_to_process.append(args.file)
-    else:
-        print(f"⚠️ File {args.file} not found in {DATA_DIR}. Skipping.")
-        exit()
-else:
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source: str, text_hash: str) -> str:
+    """Deterministic chunk ID: the same text of the same file always maps to the same vector."""
+    return hashlib.sha1(f"{source}\x00{text_hash}".encode("utf-8")).hexdigest()
+
+
+def _batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def find_files(filename: str = None) -> list[str]:
+    """The requested file if it exists, otherwise every PDF in DATA_DIR."""
+    if filename:
+        if os.path.exists(os.path.join(DATA_DIR, filename)):
+            return [filename]
+        print(f"⚠️ File {filename} not found in {DATA_DIR}. Skipping.")
+        return []
     print(f"Scanning {DATA_DIR}...")
-    files_to_process = [f for f in os.listdir(DATA_DIR) if f.endswith(".pdf")]
+    return [f for f in os.listdir(DATA_DIR) if f.endswith(".pdf")]
 
-if not files_to_process:
-    print("No files to process.")
-    exit()
 
+def _reusable_embeddings(collection, hashes: list[str]) -> dict:
+    """Embeddings already stored for byte-identical chunks (e.g. of another file), keyed by content hash."""
+    found = {}
+    for batch in _batches(hashes, UPSERT_BATCH_SIZE):
+        stored = collection.get(where={"content_hash": {"$in": batch}}, include=["embeddings", "metadatas"])
+        for embedding, metadata in zip(stored["embeddings"], stored["metadatas"]):
+            found[metadata["content_hash"]] = list(embedding)
+    return found
 
-all_chunks = []
-processed_files = 0
-splitter = RecursiveCharacterTextSplitter(
-    chunk_size=args.size,
-    chunk_overlap=args.overlap,
-    length_function=len
-)
 
-for filename in files_to_process:
-    pdf_path = os.path.join(DATA_DIR, filename)
-    print(f"Processing {pdf_path}...")
-    try:
-        md_text = pymu.to_markdown(pdf_path)
-        chunks = splitter.split_text(md_text)
-        for i, chunk in enumerate(chunks):
-            all_chunks.append(
-                Document(
-                    page_content=chunk,
-                    metadata={
-                        "source": filename,
-                        "chunk_index": i
-                    }
-                )
+class StageStats:
+    def __init__(self, unit: str):
+        self.unit = unit
+        self.count = 0
+        self.busy_s = 0.0
+
+    def add(self, count: int, seconds: float):
+        self.count += count
+        self.busy_s += seconds
+
+    def to_dict(self, wall_s: float) -> dict:
+        return {
+            self.unit: self.count,
+            "busy_s": round(self.busy_s, 3),
+            f"{self.unit}_per_s": round(self.count / wall_s, 2) if wall_s else 0.0,
+        }
+
+
+class FilePlan:
+    """What has to change in the collection for one file, built by the chunk stage."""
+
+    def __init__(self, filename: str, pages: int):
+        self.filename = filename
+        self.pages = pages
+        self.current = {}  # chunk_id -> Document, in chunk order
+        self.new_ids = []
+        self.stale_ids = []
+        self.moved_ids = []
+        self.duplicates = 0
+        self.embedded = 0
+        self.written_ids = []  # new chunks sent to Chroma, removed again if the file fails
+
+
+class ChunkItem:
+    __slots__ = ("plan", "chunk_id", "doc", "vector")
+
+    def __init__(self, plan: FilePlan, chunk_id: str, doc: Document, vector=None):
+        self.plan = plan
+        self.chunk_id = chunk_id
+        self.doc = doc
+        self.vector = vector
+
+
+_END = object()
+
+
+class IngestionPipeline:
+    """
+    Streaming ingestion: parse -> chunk -> embed -> upsert, one thread per
+    stage and bounded queues in between, so memory does not grow with the
+    corpus and the first files reach Chroma while later ones are still parsing.
+    Batches may span files; a FilePlan travels behind its chunks and is
+    finalized (stale deletes + catalog entry) once they are all upserted.
+    A failure only loses the files of the failing batch; the chunks they
+    already wrote are deleted, as the catalog would not know about them.
+    """
+
+    def __init__(self, collection, embedding_model,
+                 size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                 workers: int = INGEST_PARSE_WORKERS,
+                 embed_batch_size: int = EMBED_BATCH_SIZE,
+                 upsert_batch_size: int = UPSERT_BATCH_SIZE,
+                 queue_size: int = PIPELINE_QUEUE_SIZE,
+                 catalog=None):
+        self.collection = collection
+        self.catalog = catalog or get_catalog()
+        self.embedding_model = embedding_model
+        self.workers = workers
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=size,
+            chunk_overlap=overlap,
+            length_function=len
+        )
+        self.parsed_q = queue.Queue(maxsize=queue_size)
+        self.embed_q = queue.Queue(maxsize=queue_size * embed_batch_size)
+        self.upsert_q = queue.Queue(maxsize=queue_size * embed_batch_size)
+        self.stats = {
+            "parse": StageStats("pages"),
+            "chunk": StageStats("chunks"),
+            "embed": StageStats("embeddings"),
+            "upsert": StageStats("upserts"),
+        }
+        self.plans = []
+        self.completed = []
+        self.failed = {}
+        self._started = 0.0
+
+    def run(self, files_to_process: list[str]) -> dict:
+        self._started = time.monotonic()
+        stages = [
+            threading.Thread(target=self._guard, args=(self._parse_stage, None, files_to_process), name="ingest-parse"),
+            threading.Thread(target=self._guard, args=(self._chunk_stage, self.parsed_q), name="ingest-chunk"),
+            threading.Thread(target=self._guard, args=(self._embed_stage, self.embed_q), name="ingest-embed"),
+            threading.Thread(target=self._guard, args=(self._upsert_stage, self.upsert_q), name="ingest-upsert"),
+        ]
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+        for plan in self.plans:
+            if plan.written_ids and plan not in self.completed:
+                self._rollback(plan)
+        return self._result()
+
+    def _rollback(self, plan: FilePlan):
+        try:
+            for batch in _batches(plan.written_ids, self.upsert_batch_size):
+                self.collection.delete(ids=batch)
+            print(f"↩️ {plan.filename}: removed {len(plan.written_ids)} chunks of the failed ingestion")
+        except Exception as e:
+            print(f"⚠️ Could not remove the partial chunks of {plan.filename}: {e}")
+
+    def _guard(self, stage, inbox, *args):
+        """Runs a stage; if it crashes, its inbox is drained so upstream stages never block."""
+        try:
+            stage(*args)
+        except Exception as e:
+            print(f"💀 Ingestion stage {stage.__name__} crashed: {e}")
+            self.failed.setdefault("*", str(e))
+            if inbox is not None:
+                while inbox.get() is not _END:
+                    pass
+            self._forward_end(stage)
+
+    def _forward_end(self, stage):
+        outbox = {
+            self._parse_stage: self.parsed_q,
+            self._chunk_stage: self.embed_q,
+            self._embed_stage: self.upsert_q,
+        }.get(stage)
+        if outbox is not None:
+            outbox.put(_END)
+
+    def _fail(self, plans, error):
+        for plan in plans:
+            if plan.filename not in self.failed:
+                print(f"❌ Ingestion failed for {plan.filename}: {error}")
+                self.failed[plan.filename] = str(error)
+
+    # --- Stage 1: PDF -> markdown (process pool) ---
+    def _parse_stage(self, files_to_process):
+        started = time.monotonic()
+        for filename, md_text, pages in parse_files(files_to_process, self.workers):
+            self.stats["parse"].add(pages, time.monotonic() - started)
+            self.parsed_q.put((filename, md_text, pages))
+            started = time.monotonic()
+        self.parsed_q.put(_END)
+
+    # --- Stage 2: markdown -> chunks diffed against the catalog ---
+    def _chunk_stage(self):
+        while (item := self.parsed_q.get()) is not _END:
+            filename, md_text, pages = item
+            started = time.monotonic()
+            try:
+                plan = self._plan_file(filename, md_text, pages)
+                self.plans.append(plan)
+                new_docs = [plan.current[cid] for cid in plan.new_ids]
+                reused = _reusable_embeddings(self.collection, sorted({d.metadata["content_hash"] for d in new_docs}))
+            except Exception as e:
+                self._fail([FilePlan(filename, pages)], e)
+                continue
+            self.stats["chunk"].add(len(plan.current), time.monotonic() - started)
+            for cid in plan.new_ids:
+                doc = plan.current[cid]
+                self.embed_q.put(ChunkItem(plan, cid, doc, reused.get(doc.metadata["content_hash"])))
+            self.embed_q.put(plan)
+        self.embed_q.put(_END)
+
+    def _plan_file(self, filename: str, md_text: str, pages: int) -> FilePlan:
+        plan = FilePlan(filename, pages)
+        manifest = self.catalog.get_chunks(filename)
+        if manifest is None:
+            # Not in the catalog: chunks stored earlier (random IDs) are all stale candidates
+            stored = self.collection.get(where={"source": filename}, include=[])
+            manifest = {existing_id: {"hash": None, "chunk_index": None} for existing_id in stored["ids"]}
+
+        for i, chunk in enumerate(self.splitter.split_text(md_text)):
+            text_hash = content_hash(chunk)
+            cid = chunk_id(filename, text_hash)
+            if cid in plan.current:
+                # Repeated headers/footers: same text, same ID, embedded once
+                plan.duplicates += 1
+                continue
+            plan.current[cid] = Document(
+                page_content=chunk,
+                metadata={"source": filename, "chunk_index": i, "content_hash": text_hash}
             )
-        processed_files += 1
-    except Exception as e:
-        print(f"Error processing {pdf_path}: {e}")
 
-if not all_chunks:
-    print("No documents were successfully processed. Exiting.")
-    exit()
+        plan.new_ids = [cid for cid in plan.current if cid not in manifest]
+        plan.stale_ids = [cid for cid in manifest if cid not in plan.current]
+        plan.moved_ids = [
+            cid for cid in plan.current
+            if cid in manifest and manifest[cid]["chunk_index"] != plan.current[cid].metadata["chunk_index"]
+        ]
+        return plan
 
-print(f"\nProcessed {processed_files} files, {len(all_chunks)} total chunks.")
+    # --- Stage 3: batched embeddings, shared across files ---
+    def _embed_stage(self):
+        self._batched(self.embed_q, self.embed_batch_size, self._embed_batch, self.upsert_q.put)
+        self.upsert_q.put(_END)
 
-print("Connecting to vector store...")
+    def _embed_batch(self, batch: list[ChunkItem]):
+        to_embed = [item for item in batch if item.vector is None]
+        if to_embed:
+            started = time.monotonic()
+            try:
+                vectors = self.embedding_model.embed_documents([item.doc.page_content for item in to_embed])
+            except Exception as e:
+                self._fail({item.plan for item in to_embed}, e)
+                return
+            for item, vector in zip(to_embed, vectors):
+                item.vector = vector
+                item.plan.embedded += 1
+            self.stats["embed"].add(len(to_embed), time.monotonic() - started)
+        for item in batch:
+            self.upsert_q.put(item)
 
-if CHROMA_SERVER_HOST and CHROMA_SERVER_PORT:
-    print(f"🔌 Connecting to ChromaDB Server at {CHROMA_SERVER_HOST}:{CHROMA_SERVER_PORT}")
-    client = chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT)
-else:
-    print(f"📂 Connecting to local vector store at {CHROMA_DIR}")
-    client = chromadb.PersistentClient(path=CHROMA_DIR)
+    # --- Stage 4: batched upserts, then per-file finalization ---
+    def _upsert_stage(self):
+        self._batched(self.upsert_q, self.upsert_batch_size, self._upsert_batch, self._finalize)
 
-vector_store = Chroma(
-    client=client,
-    collection_name=COLLECTION_NAME,
-    embedding_function=embedding_function,
-)
+    def _upsert_batch(self, batch: list[ChunkItem]):
+        batch = [item for item in batch if item.plan.filename not in self.failed]
+        if not batch:
+            return
+        for item in batch:
+            # before the call: a failed upsert may still have written part of the batch
+            item.plan.written_ids.append(item.chunk_id)
+        started = time.monotonic()
+        try:
+            self.collection.upsert(
+                ids=[item.chunk_id for item in batch],
+                embeddings=[item.vector for item in batch],
+                documents=[item.doc.page_content for item in batch],
+                metadatas=[item.doc.metadata for item in batch],
+            )
+        except Exception as e:
+            self._fail({item.plan for item in batch}, e)
+            return
+        self.stats["upsert"].add(len(batch), time.monotonic() - started)
+
+    def _finalize(self, plan: FilePlan):
+        if plan.filename in self.failed:
+            return
+        try:
+            for batch in _batches(plan.moved_ids, self.upsert_batch_size):
+                self.collection.update(ids=batch, metadatas=[plan.current[cid].metadata for cid in batch])
+            for batch in _batches(plan.stale_ids, self.upsert_batch_size):
+                self.collection.delete(ids=batch)
+            self.catalog.save_document(plan.filename, {
+                cid: {"hash": doc.metadata["content_hash"], "chunk_index": doc.metadata["chunk_index"]}
+                for cid, doc in plan.current.items()
+            }, pages=plan.pages)
+        except Exception as e:
+            self._fail([plan], e)
+            return
+        self.completed.append(plan)
+        print(
+            f"📎 {plan.filename}: {len(plan.new_ids)} new ({plan.embedded} embedded), "
+            f"{len(plan.stale_ids)} removed, {len(plan.current) - len(plan.new_ids)} unchanged, "
+            f"{plan.duplicates} duplicates skipped"
+        )
+        self._report_progress()
+
+    def _batched(self, inbox: queue.Queue, size: int, flush_batch, emit_plan):
+        """
+        Collects ChunkItems in batches of `size`. FilePlans are held back
+        until the batch containing their last chunks has been flushed.
+        A partial batch is flushed when the inbox stays idle.
+        """
+        batch, plans = [], []
+
+        def flush():
+            if batch:
+                flush_batch(list(batch))
+                batch.clear()
+            for plan in plans:
+                emit_plan(plan)
+            plans.clear()
+
+        while True:
+            try:
+                item = inbox.get(timeout=PIPELINE_FLUSH_INTERVAL)
+            except queue.Empty:
+                flush()
+                continue
+            if item is _END:
+                flush()
+                return
+            if isinstance(item, FilePlan):
+                plans.append(item)
+                if not batch:
+                    flush()
+                continue
+            batch.append(item)
+            if len(batch) >= size:
+                flush()
+
+    def _report_progress(self):
+        wall = time.monotonic() - self._started
+        line = ", ".join(
+            f"{name}: {stats.count} {stats.unit} ({stats.count / wall:.1f}/s)"
+            for name, stats in self.stats.items()
+        )
+        print(f"📈 [{wall:.1f}s] {line}")
+
+    def _result(self) -> dict:
+        wall = time.monotonic() - self._started
+        return {
+            "files": len(self.completed),
+            "completed": sorted(p.filename for p in self.completed),  # finalized files, the others did not make it
+            "chunks": sum(len(p.current) for p in self.completed),
+            "pages": sum(p.pages for p in self.completed),
+            "new": sum(len(p.new_ids) for p in self.completed),
+            "embedded": sum(p.embedded for p in self.completed),
+            "removed": sum(len(p.stale_ids) for p in self.completed),
+            "duplicates": sum(p.duplicates for p in self.completed),
+            "failed": dict(self.failed),
+            "wall_s": round(wall, 3),
+            "stages": {name: stats.to_dict(wall) for name, stats in self.stats.items()},
+        }
+
+
+def ingest_files(files_to_process: list[str], collection, embedding_model,
+                 size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                 workers: int = INGEST_PARSE_WORKERS) -> dict:
+    """
+    Parses, chunks and syncs the given files with the collection.
+    The collection and the embedding model are provided by the caller,
+    so a long-lived process can reuse warm ones.
+    """
+    print(f"Processing {len(files_to_process)} files with {workers} parse workers...")
+    result = IngestionPipeline(collection, embedding_model, size, overlap, workers).run(files_to_process)
+    print(f"✅ Ingestion complete for: {files_to_process} ({result['files']} ok, {len(result['failed'])} failed)")
+    return result
+
+
+if __name__ == "__main__":
+    from langchain_chroma import Chroma
+    from embeddings import get_embedding_model
+    from retriever import get_chroma_client
+    from constants import COLLECTION_NAME
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=CHUNK_SIZE, help='Size of each text chunk')
+    parser.add_argument('--overlap', type=int, default=CHUNK_OVERLAP, help='Size of each text chunk overlap')
+    parser.add_argument('--file', type=str, default=None, help="Specific file to process (optional)")
+    parser.add_argument('--workers', type=int, default=INGEST_PARSE_WORKERS,
+                        help='Processes used to parse PDFs (split by file and page range)')
+    parser.add_argument('--embed-batch', type=int, default=EMBED_BATCH_SIZE, help='Chunks per embedding call')
+    parser.add_argument('--upsert-batch', type=int, default=UPSERT_BATCH_SIZE, help='Chunks per Chroma upsert')
+    args = parser.parse_args()
+
+    print(f"Loading {args.file if args.file else 'all PDFs'} from {DATA_DIR}...")
+    files_to_process = find_files(args.file)
+    if not files_to_process:
+        print("No files to process.")
+        exit()
 
+    print("Initializing embedding function...")
+    embedding_function = get_embedding_model()
 
-if all_chunks:
-    print(f"Adding {len(all_chunks)} chunks to vector store...")
-    vector_store.add_documents(documents=all_chunks)
-    print(f"✅ Ingestion complete for: {files_to_process}")
-else:
-    print("No chunks generated.")
+    print("Connecting to vector store...")
+    vector_store = Chroma(
+        client=get_chroma_client(),
+        collection_name=COLLECTION_NAME,
+        embedding_function=embedding_function,
+    )
+    pipeline = IngestionPipeline(
+        vector_store._collection, embedding_function, args.size, args.overlap,
+        args.workers, args.embed_batch, args.upsert_batch
+    )
+    print(json.dumps(pipeline.run(files_to_process), indent=2))
@@ -0,0 +1,126 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from constants import INGEST_CONCURRENCY, INGEST_QUEUE_SIZE, INGEST_JOB_HISTORY
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class IngestionJob:
+    """One ingestion run over one or more S3 objects ([{"file_key": ..., "chat_id": ...}])."""
+
+    def __init__(self, items: list[dict], request_id: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.request_id = request_id or self.job_id  # links the job logs to the request that queued it
+        self.items = items
+        self.file_key = items[0]["file_key"] if len(items) == 1 else f"{len(items)} files"
+        self.results = {}  # file_key -> "done" or the error of that file
+        self.status = "queued"  # queued -> running -> done | failed
+        self.chunks = 0
+        self.error = None
+        self.timings = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "file_key": self.file_key,
+            "file_keys": [item["file_key"] for item in self.items],
+            "results": self.results,
+            "request_id": self.request_id,
+            "status": self.status,
+            "chunks": self.chunks,
+            "error": self.error,
+            "timings": self.timings,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestionWorker:
+    """
+    Long-lived ingestion workers living inside the rag_service process.
+    Jobs wait in a bounded queue and are run by `concurrency` threads that
+    share the already loaded embedding model, instead of one cold
+    interpreter per uploaded file.
+    """
+
+    def __init__(self, handler,
+                 concurrency: int = INGEST_CONCURRENCY,
+                 queue_size: int = INGEST_QUEUE_SIZE,
+                 history: int = INGEST_JOB_HISTORY):
+        self.handler = handler  # handler(job) does the work and fills job.chunks / job.timings
+        self.history = history
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            for i in range(concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, file_key: str, chat_id: str = None, request_id: str = None) -> IngestionJob:
+        return self.submit_batch([{"file_key": file_key, "chat_id": chat_id}], request_id)
+
+    def submit_batch(self, items: list[dict], request_id: str = None) -> IngestionJob:
+        """Many files as a single job: one pipeline run shares embedding batches and upserts."""
+        job = IngestionJob(items, request_id)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(f"Ingestion queue is full ({self._queue.maxsize} jobs)")
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._trim()
+        return job
+
+    def _trim(self):
+        # Forget the oldest finished jobs, queued/running ones are always kept
+        finished = [j for j, job in self._jobs.items() if job.status in ("done", "failed")]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> IngestionJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> list[dict]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            job.timings["queued_s"] = job.started_at - job.created_at
+            try:
+                self.handler(job)
+                job.status = "done"
+            except Exception as e:
+                print(f"💀 Ingestion job {job.job_id} failed: {e}")
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                job.timings["total_s"] = job.finished_at - job.started_at
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "concurrency": len(self._threads),
+            **{status: statuses.count(status) for status in ("queued", "running", "done", "failed")},
+        }
@@ -1,23 +1,123 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+import time
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from retriever import Retriever
 from generator import Generator
+from resilience import LLMUnavailableError, CircuitOpenError
+from semantic_cache import SemanticCache, get_cache_store
+from ingestion_worker import IngestionWorker, QueueFullError
+from catalog import get_catalog
+from metrics import RequestContextMiddleware, INGEST_STAGE_SECONDS, request_id, log, metrics_response
 from constants import (
-    NUM_DOCS, DATA_DIR, S3_BUCKET_NAME, CHROMA_SERVER_HOST,
-    CHROMA_SERVER_PORT, COLLECTION_NAME, CHROMA_DIR, TELEGRAM_TOKEN
+    NUM_DOCS, DATA_DIR, S3_BUCKET_NAME, TELEGRAM_TOKEN, SEMANTIC_CACHE_ENABLED, UPSERT_BATCH_SIZE,
+    S3_DOWNLOAD_CONCURRENCY, INGEST_BATCH_MAX_FILES
 )
-import subprocess
-import boto3
-import os
-import sys
-import requests
-import chromadb
 
-app = FastAPI()
 
-print("Initializing RAG Service...")
-retriever = Retriever(num_docs=NUM_DOCS)
-generator = Generator()
+def process_age() -> float:
+    """Seconds since this process started (Linux /proc), 0 where it can't be read."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])  # field 22, starttime
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+# From the process start, so interpreter start-up and imports show up in the startup timings
+STARTED_AT = time.monotonic() - process_age()
+
+# Filled by load_components() once the lifespan starts
+retriever = None
+generator = None
+answer_cache = None
+startup = {"ready": False, "error": None, "timings": {}}
+
+
+def timed(phase: str, fn, *args):
+    started = time.monotonic()
+    result = fn(*args)
+    startup["timings"][phase] = round(time.monotonic() - started, 3)
+    print(f"⏱️ [STARTUP] {phase}: {startup['timings'][phase]:.2f}s")
+    return result
+
+
+def build_answer_cache():
+    return SemanticCache(get_cache_store()) if SEMANTIC_CACHE_ENABLED.lower() == "true" else None
+
+
+def warmup_embedding():
+    # The first forward pass pays for lazy torch/tokenizer init, not the first user query
+    retriever.embedding_function.embed_query("warmup")
+
+
+def ping_vector_store():
+    if not retriever.backend.is_healthy():
+        raise RuntimeError("ChromaDB is not reachable")
+
+
+def backfill_catalog():
+    # Documents indexed before the catalog existed: list them in /files, delete them by ID
+    try:
+        get_catalog().backfill_from_collection(retriever.backend.collection())
+    except Exception as e:
+        print(f"⚠️ Catalog backfill failed, will retry at the next start: {e}")
+
+
+async def load_components():
+    """Loads the independent components in parallel, then warms them up."""
+    global retriever, generator, answer_cache
+    print("Initializing RAG Service...")
+    startup["timings"]["imports"] = round(time.monotonic() - STARTED_AT, 3)
+    try:
+        retriever, generator, answer_cache = await asyncio.gather(
+            asyncio.to_thread(timed, "retriever", Retriever, NUM_DOCS),
+            asyncio.to_thread(timed, "generator", Generator),
+            asyncio.to_thread(timed, "semantic_cache", build_answer_cache),
+        )
+        await asyncio.gather(
+            asyncio.to_thread(timed, "warmup_embedding", warmup_embedding),
+            asyncio.to_thread(timed, "chroma_ping", ping_vector_store),
+        )
+        await asyncio.to_thread(timed, "catalog_backfill", backfill_catalog)
+    except Exception as e:
+        startup["error"] = str(e)
+        print(f"💀 [STARTUP] Failed: {e}")
+        return
+    startup["timings"]["total"] = round(time.monotonic() - STARTED_AT, 3)
+    startup["ready"] = True
+    print(f"✅ [STARTUP] Ready in {startup['timings']['total']:.2f}s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Loading runs in the background: /healthz answers while the model loads
+    loader = asyncio.create_task(load_components())
+    yield
+    loader.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestContextMiddleware)
+
+
+# Lets the orchestrator tell apart answers computed on different versions of the corpus
+CORPUS_VERSION_HEADER = "X-Corpus-Version"
+
+
+def require_ready():
+    if not startup["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail=startup["error"] or "Service is starting up",
+            headers={"Retry-After": "5"}
+        )
 
 
 class RAGRequest(BaseModel):
@@ -27,6 +127,8 @@ class RAGRequest(BaseModel):
 class RAGResponse(BaseModel):
     answer: str
     context_used: str  # Optional: debug mode
+    tokens_saved: int = 0  # context tokens removed by merging/compression/budget
+    degraded: bool = False  # LLM unavailable, the answer is made of context passages
 
 
 class IngestRequest(BaseModel):
@@ -34,45 +136,210 @@ class IngestRequest(BaseModel):
     chat_id: str | None = None
 
 
+class IngestBatchRequest(BaseModel):
+    files: list[IngestRequest]
+
+
+async def retrieve(query: str):
+    """Embeds the query and returns (embedding, retrieved docs, cached entry if any)."""
+    log(f"Retrieving for query: {query}")
+    embedding = await retriever.aembed(query)
+    if answer_cache:
+        # The scan (and, with SQLite, the commits) runs on the retrieval pool, off the event loop
+        cached = await asyncio.get_running_loop().run_in_executor(retriever.executor, answer_cache.lookup, embedding)
+        if cached:
+            return embedding, [], cached
+    return embedding, await retriever.asearch(embedding), None
+
+
+def degraded_reason(error: LLMUnavailableError) -> str:
+    return "circuit_open" if isinstance(error, CircuitOpenError) else "unavailable"
+
+
+async def cache_answer(query: str, embedding, answer: str, docs, context: str):
+    # No documents (empty index or failed retrieval): the answer is not worth keeping
+    if answer_cache and answer and docs:
+        sources = [doc.metadata.get("source") for doc in docs if doc.metadata.get("source")]
+        # Store + eviction on the retrieval pool, like the lookup
+        await asyncio.get_running_loop().run_in_executor(
+            retriever.executor,
+            lambda: answer_cache.store_answer(query, embedding, answer, context=context, sources=sources)
+        )
+
+
 @app.post("/generate", response_model=RAGResponse)
-def generate_response(request: RAGRequest):
+async def generate_response(request: RAGRequest, response: Response):
+    require_ready()
+    response.headers[CORPUS_VERSION_HEADER] = str(retriever.collection_version)
     try:
-        print(f"Retrieving for query: {request.query}")
-        context = retriever.get_context(request.query)
+        embedding, docs, cached = await retrieve(request.query)
+        if cached:
+            return RAGResponse(answer=cached.answer, context_used=cached.context)
+        context, tokens_saved = await retriever.abuild_context(embedding, docs)
+
+        try:
+            answer = await generator.agenerate_answer(request.query, context)
+        except LLMUnavailableError as e:
+            log(f"LLM unavailable, degraded answer: {e}")
+            answer = generator.degraded_answer(context, degraded_reason(e))
+            return RAGResponse(answer=answer, context_used=context, tokens_saved=tokens_saved, degraded=True)
+        await cache_answer(request.query, embedding, answer, docs, context)
+
+        return RAGResponse(answer=answer, context_used=context, tokens_saved=tokens_saved)
+    except Exception as e:
+        log(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        print("Generating answer...")
-        answer = generator.generate_answer(request.query, context)
 
-        return RAGResponse(answer=answer, context_used=context)
+@app.post("/generate/stream")
+async def generate_stream(request: RAGRequest):
+    """Same as /generate, but the answer is sent as a chunked text stream."""
+    require_ready()
+    try:
+        embedding, docs, cached = await retrieve(request.query)
+        if not cached:
+            context, _ = await retriever.abuild_context(embedding, docs)
     except Exception as e:
-        print(f"Error: {e}")
+        log(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def token_stream():
+        if cached:
+            yield cached.answer
+            return
+        tokens = []
+        try:
+            async for token in generator.astream_answer(request.query, context):
+                tokens.append(token)
+                yield token
+        except LLMUnavailableError as e:
+            # Failed before the first token: the degraded answer can still be sent
+            log(f"LLM unavailable, degraded answer: {e}")
+            if not tokens:
+                yield generator.degraded_answer(context, degraded_reason(e))
+            return
+        except Exception as e:
+            # Headers are already sent: re-raising aborts the chunked body, so the
+            # client sees an incomplete response instead of a short, "complete" answer
+            log(f"Error while streaming: {e}")
+            raise
+        await cache_answer(request.query, embedding, "".join(tokens), docs, context)
+
+    return StreamingResponse(
+        token_stream(), media_type="text/plain; charset=utf-8",
+        headers={CORPUS_VERSION_HEADER: str(retriever.collection_version)}
+    )
+
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up. A failed startup is reported so the container gets restarted."""
+    if startup["error"]:
+        raise HTTPException(status_code=503, detail=startup["error"])
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: model loaded and warm, vector store reachable."""
+    require_ready()
+    if not await asyncio.to_thread(retriever.backend.is_healthy):
+        raise HTTPException(status_code=503, detail="ChromaDB is not reachable")
+    return {"status": "ready", "startup": startup["timings"]}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics."""
+    return metrics_response()
+
+
+@app.get("/stats")
+def get_stats():
+    """Runtime statistics of the serving components."""
+    require_ready()
+    stats = {
+        "startup": startup["timings"],
+        "embedder": retriever.embedding_function.stats(),
+        "retrieval_cache": retriever.cache_stats(),
+        "context": retriever.context_builder.stats(),
+        "llm": generator.resilient_llm.stats(),
+        "ingestion": ingestion_worker.stats(),
+    }
+    if answer_cache:
+        stats["semantic_cache"] = answer_cache.stats()
+    return stats
+
 
 @app.post("/ingest-s3")
-def ingest_from_s3(request: IngestRequest, background_tasks: BackgroundTasks):
+def ingest_from_s3(request: IngestRequest):
     # It will be visible thanks to PYTHONUNBUFFERED
     print(f"📥 [API] Received request for: {request.file_key}")
-    background_tasks.add_task(run_ingestion_background, request.file_key, request.chat_id)
-    return {"status": "accepted", "message": "Ingestion started in background"}
+    require_ready()
+    try:
+        job = ingestion_worker.submit(request.file_key, request.chat_id, request_id.get())
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "accepted", "message": "Ingestion queued", "job_id": job.job_id}
+
+
+@app.post("/ingest-s3/batch")
+def ingest_batch_from_s3(request: IngestBatchRequest):
+    """Many S3 objects as one job: parallel downloads, then a single pipeline run."""
+    print(f"📥 [API] Received batch request for {len(request.files)} files")
+    if not request.files:
+        raise HTTPException(status_code=400, detail="No files in the batch")
+    if len(request.files) > INGEST_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {INGEST_BATCH_MAX_FILES} files per batch")
+    require_ready()
+    # la stessa chiave due volte nello stesso evento: basta scaricarla una volta
+    items = list({f.file_key: {"file_key": f.file_key, "chat_id": f.chat_id} for f in request.files}.values())
+    try:
+        job = ingestion_worker.submit_batch(items, request_id.get())
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "accepted", "message": f"Ingestion of {len(items)} files queued", "job_id": job.job_id}
+
+
+@app.get("/jobs")
+def list_jobs():
+    """Recent ingestion jobs with their status, chunk counts and timings."""
+    return {"jobs": ingestion_worker.list_jobs(), "stats": ingestion_worker.stats()}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = ingestion_worker.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
 
 @app.get("/files")
-def list_files():
-    """List all PDF files available in the DATA_DIR."""
+def list_files(request: Request):
+    """
+    Indexed documents with their chunk/page counts, size, hash and ingest time.
+    The ETag changes with every catalog update: If-None-Match gets a 304.
+    """
     try:
-        if not os.path.exists(DATA_DIR):
-            os.makedirs(DATA_DIR)
-        files = [f for f in os.listdir(DATA_DIR) if f.endswith(".pdf")]
-        return {"files": files}
+        catalog = get_catalog()
+        etag = catalog.etag()
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        documents = catalog.list_documents()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(
+        {"files": [doc["source"] for doc in documents], "documents": documents},
+        headers={"ETag": etag}
+    )
 
 
 @app.delete("/files/{filename}")
 def delete_file(filename: str):
     """Delete a file from disk and (optionally) from the Vector Store"""
     print(f"🗑️ Request to delete: {filename}")
+    require_ready()
     file_path = os.path.join(DATA_DIR, filename)
     status_msg = []
     if os.path.exists(file_path):
@@ -86,15 +353,22 @@ def delete_file(filename: str):
         status_msg.append("File not found on Disk")
 
     try:
-        if CHROMA_SERVER_HOST and CHROMA_SERVER_PORT:
-            client = chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT)
-        else:
-            client = chromadb.PersistentClient(path=CHROMA_DIR)  # Fallback
-        collection = client.get_collection(name=COLLECTION_NAME)
+        collection = retriever.backend.collection()
+        catalog = get_catalog()
 
         print(f"Removing vectors for source: {filename}...")
-        collection.delete(where={"source": filename})
+        ids = catalog.chunk_ids(filename)
+        if ids is None:
+            # Not in the catalog (indexed before it existed): metadata scan
+            collection.delete(where={"source": filename})
+        else:
+            for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+                collection.delete(ids=ids[start:start + UPSERT_BATCH_SIZE])
+        catalog.delete_document(filename)
         status_msg.append("Deleted from Vector DB")
+        retriever.bump_collection_version()
+        if answer_cache:
+            answer_cache.invalidate_source(filename)
     except Exception as e:
         print(f"⚠️ Error deleting from Chroma: {e}")
         # We do not raise a blocking error here, maybe the file was on disk but not in the db
@@ -103,46 +377,96 @@ def delete_file(filename: str):
     return {"status": "success", "details": ", ".join(status_msg), "file": filename}
 
 
-def run_ingestion_background(file_key: str, chat_id: str = None):
-    print(f"🔄 [BACKGROUND] Starting ingestion logic for: {file_key}")
+def download_from_s3(s3, file_key: str) -> str:
+    """Streams one object to DATA_DIR (download_file writes in parts, never the whole file in memory)."""
+    filename = os.path.basename(file_key)
+    print(f"⬇️ Downloading {file_key} from S3...")
+    s3.download_file(S3_BUCKET_NAME, file_key, os.path.join(DATA_DIR, filename))
+    print(f"🗑️ Deleting {file_key} from S3...")
+    s3.delete_object(Bucket=S3_BUCKET_NAME, Key=file_key)
+    return filename
+
+
+def run_ingestion_job(job):
+    """Runs inside the ingestion worker, reusing the Retriever's warm model and Chroma connection."""
+    request_id.set(job.request_id)  # worker thread: carry over the id of the request that queued it
+    log(f"🔄 [WORKER] Starting ingestion logic for: {job.file_key}")
+    import boto3  # only the ingestion path needs it
+    from concurrent.futures import ThreadPoolExecutor
+    from ingest import ingest_files
+    filenames = {}  # file_key -> local filename, only for the downloaded ones
     try:
-        s3 = boto3.client('s3')
-        filename = os.path.basename(file_key)
-        local_path = os.path.join(DATA_DIR, filename)
-
-        print(f"⬇️ Downloading {file_key} from S3...")
-        s3.download_file(S3_BUCKET_NAME, file_key, local_path)
-
-        print(f"🗑️ Deleting {file_key} from S3...")
-        s3.delete_object(Bucket=S3_BUCKET_NAME, Key=file_key)
-
-        print(f"🚀 Launching ingest.py subprocess for {file_key}...")
-        process = subprocess.Popen(
-            ["python", "ingest.py", "--file", filename],
-            stdout=sys.stdout,  # direct logs on CloudWatch
-            stderr=sys.stderr,
-            text=True
-        )
-        process.wait()  # no problem here, it's background task
-        if process.returncode == 0:
-            msg = f"✅ Ingestion completed for <b>{filename}</b>!"
-            if chat_id:
-                send_telegram_notification(chat_id, msg)
-        else:
-            msg = f"❌ Ingestion error for <b>{filename}</b>."
-            if chat_id:
-                send_telegram_notification(chat_id, msg)
+        started = time.monotonic()
+        s3 = boto3.client('s3')  # boto3 clients are thread safe
+        workers = max(1, min(S3_DOWNLOAD_CONCURRENCY, len(job.items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {item["file_key"]: pool.submit(download_from_s3, s3, item["file_key"]) for item in job.items}
+            for file_key, future in futures.items():
+                try:
+                    filenames[file_key] = future.result()
+                except Exception as e:
+                    log(f"⚠️ Download failed for {file_key}: {e}")
+                    job.results[file_key] = f"Download failed: {e}"
+        job.timings["download_s"] = time.monotonic() - started
+        INGEST_STAGE_SECONDS.labels("download").observe(job.timings["download_s"])
+        if not filenames:
+            raise RuntimeError("; ".join(job.results.values()))
 
+        # Una sola pipeline per tutto il batch: embedding e upsert condividono i batch
+        result = ingest_files(list(filenames.values()), retriever.backend.collection(), retriever.embedding_model)
+        job.chunks = result["chunks"]
+        job.timings.update(ingest_s=result["wall_s"], stages=result["stages"])
+        for stage, stats in result["stages"].items():
+            INGEST_STAGE_SECONDS.labels(stage).observe(stats["busy_s"])
+        completed = set(result["completed"])
+        for file_key, filename in filenames.items():
+            if filename in completed:
+                job.results[file_key] = "done"
+            else:
+                # parse errors are not always attributed to a file (unreadable PDF, crashed stage)
+                job.results[file_key] = (
+                    result["failed"].get(filename) or result["failed"].get("*")
+                    or "Not processed: the file could not be opened or parsed"
+                )
+        if not any(outcome == "done" for outcome in job.results.values()):
+            raise RuntimeError("; ".join(job.results.values()) or "No documents were successfully processed")
     except Exception as e:
-        print(f"💀 Critical Background Error: {e}")
-        if chat_id:
-            send_telegram_notification(chat_id, f"🔥 Critical system error: {str(e)}")
+        log(f"💀 Ingestion Error: {e}")
+        for item in job.items:
+            job.results.setdefault(item["file_key"], str(e))
+        notify_ingestion(job)
+        raise
+
+    retriever.bump_collection_version()
+    if answer_cache:
+        for file_key, outcome in job.results.items():
+            if outcome == "done":
+                answer_cache.invalidate_source(os.path.basename(file_key))
+    notify_ingestion(job)
+
+
+def notify_ingestion(job):
+    """One Telegram message per chat, listing the outcome of each of its files."""
+    by_chat = {}
+    for item in job.items:
+        by_chat.setdefault(item.get("chat_id"), []).append(item["file_key"])
+    for chat_id, file_keys in by_chat.items():
+        lines = []
+        for file_key in file_keys:
+            filename = os.path.basename(file_key)
+            outcome = job.results.get(file_key, "not processed")
+            if outcome == "done":
+                lines.append(f"✅ Ingestion completed for <b>{filename}</b>!")
+            else:
+                lines.append(f"❌ Ingestion error for <b>{filename}</b>: {outcome}")
+        send_telegram_notification(chat_id, "\n".join(lines))
 
 
 def send_telegram_notification(chat_id, message):
     """Invia un messaggio di notifica all'utente Telegram"""
     if not chat_id or not TELEGRAM_TOKEN:
         return
+    import requests
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
         requests.post(url, json={"chat_id": chat_id, "text": message, "parse_mode": "HTML"})
@@ -150,6 +474,9 @@ def send_telegram_notification(chat_id, message):
         print(f"⚠️ Failed to send Telegram notification: {e}")
 
 
+ingestion_worker = IngestionWorker(run_ingestion_job)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8002)  # Note: Port 8002 internal
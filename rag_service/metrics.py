@@ -0,0 +1,89 @@
+import time
+import uuid
+from contextvars import ContextVar
+from fastapi import Response
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Set by RequestContextMiddleware, read by log() so every line of a request can be grepped together
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds", "HTTP request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+EMBEDDING_SECONDS = Histogram(
+    "rag_query_embedding_seconds", "Query embedding latency", ["cached"], buckets=LATENCY_BUCKETS
+)
+VECTOR_SEARCH_SECONDS = Histogram(
+    "rag_vector_search_seconds", "Vector search latency", ["backend"], buckets=LATENCY_BUCKETS
+)
+CONTEXT_TOKENS = Histogram(
+    "rag_context_tokens", "Estimated tokens of the context sent to the LLM", buckets=TOKEN_BUCKETS
+)
+LLM_SECONDS = Histogram(
+    "rag_llm_seconds", "LLM call latency (full answer)", ["mode"], buckets=LATENCY_BUCKETS
+)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "rag_llm_first_token_seconds", "Time to the first streamed LLM token", buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Histogram(
+    "rag_llm_tokens", "LLM tokens per call", ["kind"], buckets=TOKEN_BUCKETS
+)
+LLM_RETRIES = Counter("rag_llm_retries", "LLM attempts retried after a failure")
+LLM_HEDGES = Counter("rag_llm_hedges", "Hedged second LLM requests", ["winner"])
+LLM_DEGRADED = Counter("rag_llm_degraded", "Answers built from the context without the LLM", ["reason"])
+LLM_CIRCUIT_OPEN = Gauge("rag_llm_circuit_open", "1 while the LLM circuit breaker is open")
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds", "Busy time of each ingestion stage per job", ["stage"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+
+
+def log(message: str):
+    print(f"[{request_id.get()}] {message}")
+
+
+class RequestContextMiddleware:
+    """
+    Pure ASGI middleware (streaming responses pass through untouched):
+    reuses the caller's X-Request-ID or creates one, echoes it in the
+    response and records the request latency per route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rid = dict(scope["headers"]).get(REQUEST_ID_HEADER.lower().encode(), b"").decode() or uuid.uuid4().hex
+        token = request_id.set(rid)
+        started = time.monotonic()
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), rid.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # Route template, not the raw path: /jobs/{job_id} must stay one series
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route.path if route else "unmatched", str(status["code"])
+            ).observe(time.monotonic() - started)
+            request_id.reset(token)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
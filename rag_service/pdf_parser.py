@@ -0,0 +1,94 @@
+import os
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+import pymupdf
+import pymupdf4llm as pymu
+from constants import DATA_DIR, INGEST_PARSE_WORKERS, PAGES_PER_TASK
+
+# Kept free of langchain/torch imports: it is what the parse processes load.
+
+
+def page_count(pdf_path: str) -> int:
+    with pymupdf.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def parse_pages(pdf_path: str, start: int, end: int) -> str:
+    return pymu.to_markdown(pdf_path, pages=list(range(start, end)))
+
+
+def plan_tasks(files: list[str], pages_per_task: int = PAGES_PER_TASK) -> list[tuple[str, int, int]]:
+    """Splits every file in (filename, first page, last page + 1) ranges."""
+    tasks = []
+    for filename in files:
+        try:
+            pages = page_count(os.path.join(DATA_DIR, filename))
+        except Exception as e:
+            print(f"Error opening {filename}: {e}")
+            continue
+        for start in range(0, pages, pages_per_task):
+            tasks.append((filename, start, min(start + pages_per_task, pages)))
+    return tasks
+
+
+def parse_files(files: list[str], workers: int = INGEST_PARSE_WORKERS, pages_per_task: int = PAGES_PER_TASK):
+    """
+    Yields (filename, markdown, pages) for each file that could be parsed, in input order,
+    as soon as all of its page ranges are converted.
+    With workers > 1 the ranges are converted on a process pool (at most
+    2 * workers in flight) and merged back in page order. The pool uses
+    "spawn": forking the rag_service process would copy the torch threads
+    and locks of the serving model.
+    """
+    tasks = plan_tasks(files, pages_per_task)
+    if workers > 1 and len(tasks) > 1:
+        results = _pooled_results(tasks, workers)
+    else:
+        results = (_parse_task(task) for task in tasks)
+
+    current, parts, pages = None, [], 0
+    for (filename, start, end), result in zip(tasks, results):
+        if filename != current:
+            if current is not None:
+                yield from _merged(current, parts, pages)
+            current, parts, pages = filename, [], 0
+        parts.append(result)
+        pages += end - start
+    if current is not None:
+        yield from _merged(current, parts, pages)
+
+
+def _parse_task(task):
+    filename, start, end = task
+    try:
+        return parse_pages(os.path.join(DATA_DIR, filename), start, end)
+    except Exception as e:
+        return e
+
+
+def _pooled_results(tasks, workers: int):
+    """Results of the tasks in order, keeping a bounded number of them in flight."""
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        pending = deque()
+        remaining = iter(tasks)
+        for task in islice(remaining, 2 * workers):
+            pending.append(pool.submit(_parse_task, task))
+        while pending:
+            result = pending.popleft().result()
+            for task in islice(remaining, 1):
+                pending.append(pool.submit(_parse_task, task))
+            yield result
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def _merged(filename: str, parts: list, pages: int):
+    # A single failing range discards the whole file
+    errors = [p for p in parts if isinstance(p, Exception)]
+    if errors:
+        print(f"Error processing {filename}: {errors[0]}")
+        return
+    yield filename, "".join(parts), pages
@@ -0,0 +1,230 @@
+import time
+import random
+import asyncio
+from collections import deque
+from metrics import LLM_RETRIES, LLM_HEDGES, LLM_CIRCUIT_OPEN, log
+from constants import (
+    LLM_DEADLINE_S, LLM_STREAM_IDLE_S, LLM_HEDGE_AFTER_MS, LLM_MAX_RETRIES, LLM_RETRY_BACKOFF_MS,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT_S
+)
+
+
+class LLMUnavailableError(Exception):
+    """The LLM gave no answer within the deadline and retries."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """The circuit breaker is open: the LLM is not even tried."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failed calls.
+    After `reset_timeout` one trial call goes through (half open): success
+    closes the circuit, failure or cancellation opens it again. A trial
+    that never reports back expires after another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT_S):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_at = 0.0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if (self.state == "open" and now - self.opened_at >= self.reset_timeout
+                or self.state == "half_open" and now - self.trial_at >= self.reset_timeout):
+            self.state = "half_open"
+            self.trial_at = now
+            return True  # the trial call
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        LLM_CIRCUIT_OPEN.set(0)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+                log(f"⚡ LLM circuit opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            LLM_CIRCUIT_OPEN.set(1)
+
+    def record_cancelled(self):
+        # A caller going away says nothing about the LLM, unless it was the trial call
+        if self.state == "half_open":
+            self.record_failure()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+
+class ResilientLLM:
+    """
+    Wraps an LLM (ainvoke/astream) with a deadline for the whole call,
+    an optional hedged second request, bounded retries with jittered
+    backoff and a circuit breaker. Raises LLMUnavailableError when no
+    answer came, so the caller can fall back to a degraded one.
+    """
+
+    def __init__(self, llm,
+                 deadline: float = LLM_DEADLINE_S,
+                 stream_idle_timeout: float = LLM_STREAM_IDLE_S,
+                 hedge_after_ms: str = LLM_HEDGE_AFTER_MS,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 backoff_ms: float = LLM_RETRY_BACKOFF_MS,
+                 breaker: CircuitBreaker | None = None):
+        self.llm = llm
+        self.deadline = deadline
+        self.stream_idle_timeout = stream_idle_timeout
+        self.hedge_after_ms = hedge_after_ms
+        self.max_retries = max_retries
+        self.backoff_ms = backoff_ms
+        self.breaker = breaker or CircuitBreaker()
+        self._latencies = deque(maxlen=200)  # successful calls, for the "auto" hedge delay
+
+    def hedge_delay(self) -> float | None:
+        """Seconds before sending the hedged request, None when hedging is off."""
+        if self.hedge_after_ms.lower() == "auto":
+            if len(self._latencies) < 20:
+                return None
+            ordered = sorted(self._latencies)
+            return ordered[int(0.95 * (len(ordered) - 1))]
+        delay = float(self.hedge_after_ms) / 1000
+        return delay if delay > 0 else None
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponential with full jitter, so the retries of many callers don't line up
+        return random.uniform(0, self.backoff_ms / 1000 * 2 ** attempt)
+
+    async def _hedged(self, prompt: str):
+        delay = self.hedge_delay()
+        first = asyncio.create_task(self.llm.ainvoke(prompt))
+        tasks = {first}
+        try:
+            if delay is None:
+                return await first
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks.add(asyncio.create_task(self.llm.ainvoke(prompt)))
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            LLM_HEDGES.labels("first" if task is first else "hedge").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def ainvoke(self, prompt: str):
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        deadline_at = time.monotonic() + self.deadline
+        error = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                started = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(self._hedged(prompt), remaining)
+                except asyncio.TimeoutError:
+                    error = TimeoutError(f"no answer within the {self.deadline}s deadline")
+                    break
+                except Exception as e:
+                    error = e
+                    log(f"LLM attempt {attempt + 1} failed: {e}")
+                    if attempt < self.max_retries:
+                        LLM_RETRIES.inc()
+                        await asyncio.sleep(min(self._backoff(attempt), max(0, deadline_at - time.monotonic())))
+                    continue
+                self._latencies.append(time.monotonic() - started)
+                self.breaker.record_success()
+                return response
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        self.breaker.record_failure()
+        raise LLMUnavailableError(str(error)) from error
+
+    async def astream(self, prompt: str):
+        """
+        Same policy up to the first chunk: an attempt that fails before
+        producing anything is retried. Once chunks are sent it can't be, a
+        failure then just ends the stream with an error. After the first
+        chunk the deadline no longer applies, only an idle timeout between
+        chunks, so long answers are not cut. No hedging here.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        deadline_at = time.monotonic() + self.deadline
+        error = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                stream = self.llm.astream(prompt).__aiter__()
+                try:
+                    first = await asyncio.wait_for(stream.__anext__(), remaining)
+                except StopAsyncIteration:
+                    self.breaker.record_success()
+                    return
+                except asyncio.TimeoutError:
+                    error = TimeoutError(f"no answer within the {self.deadline}s deadline")
+                    await stream.aclose()
+                    break
+                except Exception as e:
+                    error = e
+                    log(f"LLM stream attempt {attempt + 1} failed: {e}")
+                    await stream.aclose()
+                    if attempt < self.max_retries:
+                        LLM_RETRIES.inc()
+                        await asyncio.sleep(min(self._backoff(attempt), max(0, deadline_at - time.monotonic())))
+                    continue
+
+                try:
+                    yield first
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), self.stream_idle_timeout)
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise TimeoutError(f"no chunk for {self.stream_idle_timeout}s, the stream stalled")
+                        yield chunk
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                finally:
+                    await stream.aclose()
+                self.breaker.record_success()
+                return
+        except (asyncio.CancelledError, GeneratorExit):
+            # cancelled, or the SSE client went away and the generator was closed
+            self.breaker.record_cancelled()
+            raise
+        self.breaker.record_failure()
+        raise LLMUnavailableError(str(error)) from error
+
+    def stats(self) -> dict:
+        delay = self.hedge_delay()
+        return {"breaker": self.breaker.stats(), "hedge_after_ms": round(1000 * delay) if delay else None}
@@ -1,7 +1,21 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from constants import CHROMA_DIR, COLLECTION_NAME, EMBEDDING_MODEL_NAME, CHROMA_SERVER_HOST, CHROMA_SERVER_PORT
+from embedder import BatchingEmbedder
+from embeddings import get_embedding_model
+from cache import LRUCache
+from context_builder import ContextBuilder, estimate_tokens
+from vector_index import MmapVectorIndex
+from catalog import get_catalog
+from metrics import EMBEDDING_SECONDS, VECTOR_SEARCH_SECONDS, CONTEXT_TOKENS
+from constants import (
+    CHROMA_DIR, COLLECTION_NAME, CHROMA_SERVER_HOST, CHROMA_SERVER_PORT,
+    CHROMA_MAX_CONCURRENCY, CHROMA_HEALTHCHECK_INTERVAL, RETRIEVAL_WORKERS,
+    QUERY_EMBEDDING_CACHE_SIZE, RETRIEVAL_CACHE_SIZE, RETRIEVAL_BACKEND
+)
 
 
 def get_chroma_client():
@@ -15,29 +29,222 @@ def get_chroma_client():
         return chromadb.PersistentClient(path=CHROMA_DIR)
 
 
-class Retriever:
-    def __init__(self, num_docs: int = 5):
-        print("Initializing embedding function (Heavy Model)...")
-        self.embedding_function = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-        self.num_docs = num_docs
+class ChromaBackend:
+    """
+    Process-wide Chroma connection. The HttpClient keeps its keep-alive
+    connection pool and the collection handle for the whole process lifetime,
+    it is health-checked periodically and rebuilt after a Chroma restart.
+    """
 
-    def get_context(self, query: str) -> str:
-        # Otteniamo il client corretto (Server o Locale)
-        client = get_chroma_client()
+    def __init__(self, embedding_function,
+                 max_concurrency: int = CHROMA_MAX_CONCURRENCY,
+                 healthcheck_interval: float = CHROMA_HEALTHCHECK_INTERVAL):
+        self.embedding_function = embedding_function
+        self.healthcheck_interval = healthcheck_interval
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._client = None
+        self._vector_store = None
+        self._last_check = 0.0
 
-        vector_store = Chroma(
+    def _connect(self):
+        client = get_chroma_client()
+        self._vector_store = Chroma(
             client=client,
             collection_name=COLLECTION_NAME,
             embedding_function=self.embedding_function,
         )
+        self._client = client
+        self._last_check = time.monotonic()
+
+    def _ensure_connected(self):
+        with self._lock:
+            if self._client is None:
+                self._connect()
+            elif time.monotonic() - self._last_check > self.healthcheck_interval:
+                if self._ping():
+                    self._last_check = time.monotonic()
+                else:
+                    print("♻️ ChromaDB heartbeat failed, reconnecting...")
+                    self._connect()
+            return self._vector_store
 
-        retriever = vector_store.as_retriever(search_kwargs={"k": self.num_docs})
+    def _ping(self) -> bool:
+        try:
+            self._client.heartbeat()
+            return True
+        except Exception as e:
+            print(f"⚠️ ChromaDB heartbeat error: {e}")
+            return False
 
-        print(f"🔎 Retrieving docs for: {query}")
+    def is_healthy(self) -> bool:
         try:
-            retrieved_docs = retriever.invoke(query)
-            formatted_context = "\n\n---\n\n".join(doc.page_content for doc in retrieved_docs)
-            return formatted_context
+            self._ensure_connected()
+        except Exception as e:
+            print(f"⚠️ ChromaDB unreachable: {e}")
+            return False
+        return self._ping()
+
+    def reset(self):
+        """Drops the current client, the next call opens a new one."""
+        with self._lock:
+            self._client = None
+            self._vector_store = None
+
+    def run(self, operation):
+        """
+        Runs operation(vector_store) holding one of the concurrency slots.
+        A failing call is retried once on a fresh connection.
+        """
+        with self._slots:
+            try:
+                return operation(self._ensure_connected())
+            except Exception as e:
+                print(f"♻️ ChromaDB call failed ({e}), retrying on a new connection...")
+                self.reset()
+                return operation(self._ensure_connected())
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int):
+        return self.run(lambda store: store.similarity_search_by_vector(embedding, k=k))
+
+    def collection(self):
+        """Raw chromadb collection, for deletes and maintenance operations."""
+        return self.run(lambda store: store._collection)
+
+
+class Retriever:
+    def __init__(self, num_docs: int = 5):
+        print("Initializing embedding function (Heavy Model)...")
+        self.embedding_model = get_embedding_model()
+        # Concurrent queries share one forward pass through the model
+        self.embedding_function = BatchingEmbedder(self.embedding_model)
+        self.num_docs = num_docs
+        self.backend = ChromaBackend(self.embedding_function)
+        # Dedicated pool for the blocking Chroma calls, so they never compete
+        # with the FastAPI default threadpool
+        self.executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        self.context_builder = ContextBuilder(self.embedding_model)
+        # normalized query -> embedding, (embedding, k, collection version) -> docs
+        self.embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+        self.results_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+        # The version lives in the catalog, so every worker and replica sharing it sees a change
+        self.catalog = get_catalog()
+
+        # Optional in-process index, Chroma stays the source of truth
+        self.vector_index = MmapVectorIndex() if RETRIEVAL_BACKEND.lower() == "mmap" else None
+        self._index_stale = False
+        self._export_pending = False
+        self._export_lock = threading.Lock()
+        if self.vector_index and not self._index_current():
+            self.refresh_vector_index()
+
+    @property
+    def collection_version(self) -> int:
+        return self.catalog.version()
+
+    def bump_collection_version(self):
+        """Called after every ingestion/deletion: cached results of older versions become unreachable."""
+        self.catalog.bump_version()
+        self.refresh_vector_index()
+        return self.collection_version
+
+    def refresh_vector_index(self):
+        """
+        Re-exports the collection to a new index snapshot in the background.
+        Until it is published, searches go to Chroma. Bursts of changes are
+        coalesced into a single export.
+        """
+        if not self.vector_index:
+            return
+        with self._export_lock:
+            self._index_stale = True
+            if self._export_pending:
+                return
+            self._export_pending = True
+        threading.Thread(target=self._export_vector_index, name="vector-index-export", daemon=True).start()
+
+    def _index_current(self, version: int | None = None) -> bool:
+        """The mapped snapshot was exported at the current catalog version."""
+        if version is None:
+            version = self.collection_version
+        return self.vector_index.ready() and self.vector_index.collection_version == version
+
+    def _export_vector_index(self):
+        while True:
+            version = self.collection_version
+            try:
+                # Another worker may have published it already
+                self.vector_index.refresh()
+                if not self._index_current(version):
+                    self.vector_index.export_from(self.backend.collection(), version)
+            except Exception as e:
+                print(f"⚠️ Vector index export failed, staying on Chroma: {e}")
+                with self._export_lock:
+                    self._export_pending = False
+                return
+            with self._export_lock:
+                if version == self.collection_version:
+                    self._index_stale = False
+                    self._export_pending = False
+                    return
+
+    def search_by_vector(self, embedding: list[float], k: int):
+        started = time.monotonic()
+        if self.vector_index and not self._index_stale and self._index_current():
+            backend, docs = "mmap", self.vector_index.search(embedding, k)
+        else:
+            if self.vector_index and not self._index_stale and self.vector_index.ready():
+                # Snapshot from an older catalog version (CLI ingest, another worker, a restart)
+                self.refresh_vector_index()
+            backend, docs = "chroma", self.backend.similarity_search_by_vector(embedding, k)
+        VECTOR_SEARCH_SECONDS.labels(backend).observe(time.monotonic() - started)
+        return docs
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        # all-MiniLM-L6-v2 is uncased, so case and spacing don't change the vector
+        return " ".join(query.lower().split())
+
+    async def aembed(self, query: str) -> list[float]:
+        started = time.monotonic()
+        key = self.normalize_query(query)
+        embedding = self.embedding_cache.get(key)
+        cached = embedding is not None
+        if not cached:
+            embedding = await self.embedding_function.aembed_query(key)
+            self.embedding_cache.put(key, embedding)
+        EMBEDDING_SECONDS.labels(str(cached).lower()).observe(time.monotonic() - started)
+        return embedding
+
+    async def asearch(self, embedding: list[float]):
+        """Nearest chunks for an already embedded query, run on the retrieval pool."""
+        generation = self.vector_index.generation if self.vector_index else None
+        key = (tuple(embedding), self.num_docs, self.collection_version, generation)
+        docs = self.results_cache.get(key)
+        if docs is not None:
+            return docs
+        try:
+            loop = asyncio.get_running_loop()
+            docs = await loop.run_in_executor(
+                self.executor, self.search_by_vector, embedding, self.num_docs
+            )
+            self.results_cache.put(key, docs)
+            return docs
         except Exception as e:
             print(f"❌ Error retrieving docs: {e}")
-            return ""
+            return []
+
+    async def abuild_context(self, embedding: list[float], docs) -> tuple[str, int]:
+        """Merged, deduplicated and budgeted context, plus the tokens it saved."""
+        loop = asyncio.get_running_loop()
+        context, saved = await loop.run_in_executor(self.executor, self.context_builder.build, embedding, docs)
+        CONTEXT_TOKENS.observe(estimate_tokens(context))
+        return context, saved
+
+    def cache_stats(self) -> dict:
+        return {
+            "collection_version": self.collection_version,
+            "query_embeddings": self.embedding_cache.stats(),
+            "retrieval_results": self.results_cache.stats(),
+            "vector_index": self.vector_index.stats() if self.vector_index else None,
+        }
@@ -0,0 +1,304 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+import numpy as np
+from constants import (
+    SEMANTIC_CACHE_BACKEND, SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_MAX_BYTES
+)
+
+
+def normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class CacheEntry:
+    query: str
+    embedding: np.ndarray  # unit-normalized float32
+    answer: str
+    context: str
+    sources: list[str]
+    entry_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+
+    @property
+    def nbytes(self) -> int:
+        return self.embedding.nbytes + len(self.query) + len(self.answer) + len(self.context)
+
+
+class CacheStore(ABC):
+    @abstractmethod
+    def put(self, entry: CacheEntry):
+        pass
+
+    @abstractmethod
+    def nearest(self, embedding: np.ndarray) -> tuple[CacheEntry | None, float]:
+        """Returns the entry with the highest cosine similarity and its score."""
+        pass
+
+    @abstractmethod
+    def touch(self, entry_id: str):
+        pass
+
+    @abstractmethod
+    def delete(self, entry_ids: list[str]):
+        pass
+
+    @abstractmethod
+    def entries(self) -> list[CacheEntry]:
+        pass
+
+    @abstractmethod
+    def evict(self, ttl: float, max_entries: int, max_bytes: int) -> int:
+        """Drops expired entries, then the least recently used until both caps hold. Returns how many."""
+        pass
+
+# Implementation 1: in-process (default)
+
+
+class InMemoryCacheStore(CacheStore):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, CacheEntry] = {}
+        # Embedding matrix is rebuilt lazily after a change
+        self._ids: list[str] = []
+        self._matrix = None
+
+    def put(self, entry: CacheEntry):
+        with self._lock:
+            self._entries[entry.entry_id] = entry
+            self._matrix = None
+
+    def nearest(self, embedding):
+        with self._lock:
+            if not self._entries:
+                return None, 0.0
+            if self._matrix is None:
+                self._ids = list(self._entries)
+                self._matrix = np.stack([self._entries[i].embedding for i in self._ids])
+            scores = self._matrix @ embedding
+            best = int(np.argmax(scores))
+            return self._entries[self._ids[best]], float(scores[best])
+
+    def touch(self, entry_id):
+        with self._lock:
+            if entry_id in self._entries:
+                self._entries[entry_id].last_access = time.time()
+
+    def delete(self, entry_ids):
+        with self._lock:
+            for entry_id in entry_ids:
+                self._entries.pop(entry_id, None)
+            self._matrix = None
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def evict(self, ttl, max_entries, max_bytes):
+        now = time.time()
+        entries = self.entries()
+        expired = [e for e in entries if now - e.created_at > ttl]
+        alive = sorted((e for e in entries if now - e.created_at <= ttl), key=lambda e: e.last_access)
+        total_bytes = sum(e.nbytes for e in alive)
+        victims = [e.entry_id for e in expired]
+        # Least recently used first, until both caps are respected
+        while alive and (len(alive) > max_entries or total_bytes > max_bytes):
+            oldest = alive.pop(0)
+            total_bytes -= oldest.nbytes
+            victims.append(oldest.entry_id)
+        if victims:
+            self.delete(victims)
+        return len(victims)
+
+# Implementation 2: SQLite file, shared between uvicorn workers
+
+
+class SQLiteCacheStore(CacheStore):
+    """
+    Lookups only scan the embeddings of live entries, most recently used
+    first, up to `scan_limit` rows; eviction runs entirely in SQL.
+    """
+
+    def __init__(self, filepath=SEMANTIC_CACHE_PATH,
+                 ttl: float = SEMANTIC_CACHE_TTL,
+                 scan_limit: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.scan_limit = scan_limit
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                entry_id TEXT PRIMARY KEY, query TEXT, embedding BLOB, answer TEXT,
+                context TEXT, sources TEXT, created_at REAL, last_access REAL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_created_at ON answers (created_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def _to_entry(row) -> CacheEntry:
+        return CacheEntry(
+            entry_id=row[0], query=row[1], embedding=np.frombuffer(row[2], dtype=np.float32),
+            answer=row[3], context=row[4], sources=json.loads(row[5]),
+            created_at=row[6], last_access=row[7]
+        )
+
+    def put(self, entry):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry.entry_id, entry.query, entry.embedding.tobytes(), entry.answer,
+                 entry.context, json.dumps(entry.sources), entry.created_at, entry.last_access)
+            )
+            self._conn.commit()
+
+    def nearest(self, embedding):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT entry_id, embedding FROM answers WHERE created_at >= ? ORDER BY last_access DESC LIMIT ?",
+                (time.time() - self.ttl, self.scan_limit)
+            ).fetchall()
+            if not rows:
+                return None, 0.0
+            matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+            scores = matrix @ embedding
+            best = int(np.argmax(scores))
+            row = self._conn.execute(
+                "SELECT * FROM answers WHERE entry_id = ?", (rows[best][0],)
+            ).fetchone()
+        return (self._to_entry(row), float(scores[best])) if row else (None, 0.0)
+
+    def touch(self, entry_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE answers SET last_access = ? WHERE entry_id = ?", (time.time(), entry_id)
+            )
+            self._conn.commit()
+
+    def delete(self, entry_ids):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM answers WHERE entry_id = ?", [(i,) for i in entry_ids]
+            )
+            self._conn.commit()
+
+    def entries(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM answers").fetchall()
+        return [self._to_entry(row) for row in rows]
+
+    def evict(self, ttl, max_entries, max_bytes):
+        cutoff = time.time() - ttl
+        with self._lock:
+            # Live entries newest first: past the entry cap or the running size cap they go
+            cursor = self._conn.execute(
+                """DELETE FROM answers WHERE created_at < ? OR entry_id IN (
+                    SELECT entry_id FROM (
+                        SELECT entry_id,
+                            ROW_NUMBER() OVER recent AS position,
+                            SUM(length(embedding) + length(query) + length(answer) + length(context))
+                                OVER recent AS running_bytes
+                        FROM answers WHERE created_at >= ?
+                        WINDOW recent AS (ORDER BY last_access DESC)
+                    ) WHERE position > ? OR running_bytes > ?
+                )""",
+                (cutoff, cutoff, max_entries, max_bytes)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+
+def get_cache_store() -> CacheStore:
+    if SEMANTIC_CACHE_BACKEND.lower() == "sqlite":
+        return SQLiteCacheStore()
+    return InMemoryCacheStore()
+
+
+class SemanticCache:
+    """
+    Answer cache keyed on query embeddings: a query whose cosine similarity
+    with a cached one is above the threshold reuses its answer.
+    Entries remember the sources they were built from, so they can be
+    dropped when one of those documents changes.
+    """
+
+    def __init__(self, store: CacheStore,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = SEMANTIC_CACHE_TTL,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 max_bytes: int = SEMANTIC_CACHE_MAX_BYTES):
+        self.store = store
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._stats_lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._counters[name] += amount
+
+    def lookup(self, embedding) -> CacheEntry | None:
+        entry, score = self.store.nearest(normalize(embedding))
+        if entry is None or score < self.threshold:
+            self._count("misses")
+            return None
+        if time.time() - entry.created_at > self.ttl:
+            self.store.delete([entry.entry_id])
+            self._count("evictions")
+            self._count("misses")
+            return None
+        self.store.touch(entry.entry_id)
+        self._count("hits")
+        print(f"🎯 Semantic cache hit ({score:.3f}) for: {entry.query}")
+        return entry
+
+    def store_answer(self, query: str, embedding, answer: str, context: str, sources):
+        self.store.put(CacheEntry(
+            query=query,
+            embedding=normalize(embedding),
+            answer=answer,
+            context=context,
+            sources=sorted(set(sources)),
+        ))
+        self._count("stores")
+        self._evict()
+
+    def _evict(self):
+        evicted = self.store.evict(self.ttl, self.max_entries, self.max_bytes)
+        if evicted:
+            self._count("evictions", evicted)
+
+    def invalidate_source(self, source: str):
+        """
+        Drops the answers built from `source`, plus the ones that found no
+        context at all: a new document could now answer them.
+        """
+        victims = [e.entry_id for e in self.store.entries() if source in e.sources or not e.sources]
+        if victims:
+            self.store.delete(victims)
+            self._count("invalidations", len(victims))
+            print(f"🧹 Semantic cache: dropped {len(victims)} answers for {source}")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        counters["entries"] = len(self.store.entries())
+        counters["backend"] = type(self.store).__name__
+        return counters
@@ -0,0 +1,80 @@
+import math
+import time
+import random
+import asyncio
+import hashlib
+from langchain_core.messages import AIMessage, AIMessageChunk
+from constants import (
+    STUB_LLM_LATENCY_MS, STUB_LLM_LATENCY_SIGMA, STUB_LLM_FIRST_TOKEN_MS, STUB_LLM_ANSWER_TOKENS,
+    STUB_LLM_SEED, STUB_LLM_ERROR_RATE, CHARS_PER_TOKEN
+)
+
+WORDS = ("the", "context", "states", "that", "retrieval", "answer", "model", "chunk", "latency",
+         "vector", "query", "document", "token", "because", "therefore", "section", "result")
+
+
+class StubLLM:
+    """
+    Deterministic stand-in for ChatGoogleGenerativeAI (invoke/ainvoke/astream).
+    The latency of a prompt is drawn from a lognormal distribution seeded by
+    the prompt itself: the same trace replays with the same timings, with no
+    network and no quota. `error_rate` makes a share of the calls fail
+    (per call, not per prompt, so a retry can succeed).
+    """
+
+    def __init__(self, latency_ms: float = STUB_LLM_LATENCY_MS,
+                 sigma: float = STUB_LLM_LATENCY_SIGMA,
+                 first_token_ms: float = STUB_LLM_FIRST_TOKEN_MS,
+                 answer_tokens: int = STUB_LLM_ANSWER_TOKENS,
+                 seed: int = STUB_LLM_SEED,
+                 error_rate: float = STUB_LLM_ERROR_RATE):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.first_token_ms = first_token_ms
+        self.answer_tokens = answer_tokens
+        self.seed = seed
+        self.error_rate = error_rate
+        self._errors = random.Random(seed)
+
+    def _maybe_fail(self):
+        if self.error_rate and self._errors.random() < self.error_rate:
+            raise RuntimeError("stub LLM: injected failure")
+
+    def _plan(self, prompt: str) -> tuple[float, list[str]]:
+        """(total latency in seconds, answer tokens) for a prompt."""
+        digest = hashlib.sha1(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        latency = self.latency_ms * math.exp(rng.gauss(0, self.sigma)) if self.sigma else self.latency_ms
+        tokens = [rng.choice(WORDS) + " " for _ in range(self.answer_tokens)]
+        return latency / 1000, tokens
+
+    @staticmethod
+    def _usage(prompt: str, tokens: list[str]) -> dict:
+        input_tokens = max(1, len(prompt) // CHARS_PER_TOKEN)
+        return {"input_tokens": input_tokens, "output_tokens": len(tokens),
+                "total_tokens": input_tokens + len(tokens)}
+
+    def invoke(self, prompt: str) -> AIMessage:
+        latency, tokens = self._plan(prompt)
+        time.sleep(latency)
+        self._maybe_fail()
+        return AIMessage(content="".join(tokens), usage_metadata=self._usage(prompt, tokens))
+
+    async def ainvoke(self, prompt: str) -> AIMessage:
+        latency, tokens = self._plan(prompt)
+        await asyncio.sleep(latency)
+        self._maybe_fail()
+        return AIMessage(content="".join(tokens), usage_metadata=self._usage(prompt, tokens))
+
+    async def astream(self, prompt: str):
+        latency, tokens = self._plan(prompt)
+        first = min(self.first_token_ms / 1000, latency)
+        # The rest of the latency is spread evenly between the tokens
+        interval = (latency - first) / max(1, len(tokens) - 1)
+        await asyncio.sleep(first)
+        self._maybe_fail()
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(interval)
+            yield AIMessageChunk(content=token)
+        yield AIMessageChunk(content="", usage_metadata=self._usage(prompt, tokens))
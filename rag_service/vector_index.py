@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import shutil
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from constants import (
+    VECTOR_INDEX_DIR, VECTOR_INDEX_QUANTIZATION, VECTOR_INDEX_RESCORE_FACTOR,
+    VECTOR_INDEX_REFRESH_INTERVAL, VECTOR_INDEX_EXPORT_PAGE
+)
+
+SCAN_BLOCK = 16384  # rows converted to float32 at a time during the quantized scan
+
+
+class StringTable:
+    """Variable-length strings stored as one UTF-8 blob plus an offsets array, both memory-mapped."""
+
+    def __init__(self, path_prefix: str):
+        self.blob = np.memmap(path_prefix + ".bin", dtype=np.uint8, mode="r") \
+            if os.path.getsize(path_prefix + ".bin") else np.zeros(0, dtype=np.uint8)
+        self.offsets = np.load(path_prefix + ".offsets.npy", mmap_mode="r")
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+
+class StringTableWriter:
+    def __init__(self, path_prefix: str):
+        self.path_prefix = path_prefix
+        self._file = open(path_prefix + ".bin", "wb")
+        self._offsets = [0]
+
+    def add(self, s: str):
+        data = s.encode("utf-8")
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        self._file.close()
+        np.save(self.path_prefix + ".offsets.npy", np.asarray(self._offsets, dtype=np.int64))
+
+
+class Snapshot:
+    def __init__(self, path: str):
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.name = os.path.basename(path)
+        self.count = self.manifest["count"]
+        self.quantization = self.manifest["quantization"]
+        self.collection_version = self.manifest.get("collection_version")  # catalog version it was exported at
+        # Read-only maps: every uvicorn worker shares the same pages of the OS cache
+        self.vectors = np.load(os.path.join(path, "vectors.f32.npy"), mmap_mode="r")[:self.count]
+        self.quantized = None
+        self.scales = None
+        if self.quantization == "int8":
+            self.quantized = np.load(os.path.join(path, "vectors.i8.npy"), mmap_mode="r")
+            self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+        elif self.quantization == "float16":
+            self.quantized = np.load(os.path.join(path, "vectors.f16.npy"), mmap_mode="r")
+        self.ids = StringTable(os.path.join(path, "ids"))
+        self.documents = StringTable(os.path.join(path, "documents"))
+        self.metadatas = StringTable(os.path.join(path, "metadatas"))
+
+
+class MmapVectorIndex:
+    """
+    In-process exact/quantized search over a snapshot of the Chroma collection.
+    Embeddings live in a memory-mapped float32 matrix (optionally with an
+    int8/float16 copy for the scan); a query is a blocked matmul + top-k,
+    followed by exact float32 rescoring of the best candidates.
+    Snapshots are written to a new directory and published by swapping the
+    CURRENT pointer, so readers in other workers just remap the new files.
+    """
+
+    def __init__(self, index_dir: str = VECTOR_INDEX_DIR,
+                 quantization: str = VECTOR_INDEX_QUANTIZATION,
+                 rescore_factor: int = VECTOR_INDEX_RESCORE_FACTOR,
+                 refresh_interval: float = VECTOR_INDEX_REFRESH_INTERVAL):
+        self.index_dir = index_dir
+        self.quantization = quantization.lower()
+        self.rescore_factor = rescore_factor
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def generation(self) -> str | None:
+        return self._snapshot.name if self._snapshot else None
+
+    @property
+    def collection_version(self) -> int | None:
+        """Catalog version of the mapped snapshot: it may only serve queries while that is still current."""
+        self._maybe_refresh()
+        return self._snapshot.collection_version if self._snapshot else None
+
+    def ready(self) -> bool:
+        self._maybe_refresh()
+        return self._snapshot is not None and self._snapshot.count > 0
+
+    # --- publishing ---
+    def export_from(self, collection, collection_version: int | None = None) -> str | None:
+        """Dumps the whole collection into a new snapshot, tagged with the catalog version, and publishes it."""
+        with self._export_lock:
+            started = time.monotonic()
+            expected = collection.count()
+            if not expected:
+                self._unpublish()
+                return None
+
+            name = f"snapshot-{time.time_ns()}"
+            tmp_path = os.path.join(self.index_dir, f".{name}.tmp")
+            os.makedirs(tmp_path, exist_ok=True)
+            tables = {
+                key: StringTableWriter(os.path.join(tmp_path, key))
+                for key in ("ids", "documents", "metadatas")
+            }
+            vectors = None
+            written = 0
+            # Paged, so the export never holds the whole collection in memory
+            for offset in range(0, expected, VECTOR_INDEX_EXPORT_PAGE):
+                page = collection.get(
+                    limit=VECTOR_INDEX_EXPORT_PAGE, offset=offset,
+                    include=["embeddings", "documents", "metadatas"]
+                )
+                batch = np.asarray(page["embeddings"], dtype=np.float32)[:expected - written]
+                if not len(batch):
+                    break
+                if vectors is None:
+                    vectors = np.lib.format.open_memmap(
+                        os.path.join(tmp_path, "vectors.f32.npy"), mode="w+",
+                        dtype=np.float32, shape=(expected, batch.shape[1])
+                    )
+                batch /= np.linalg.norm(batch, axis=1, keepdims=True) + 1e-12
+                vectors[written:written + len(batch)] = batch
+                for i in range(len(batch)):
+                    tables["ids"].add(page["ids"][i])
+                    tables["documents"].add(page["documents"][i] or "")
+                    tables["metadatas"].add(json.dumps(page["metadatas"][i] or {}))
+                written += len(batch)
+            for table in tables.values():
+                table.close()
+
+            if not written:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                self._unpublish()
+                return None
+            vectors.flush()
+            self._write_quantized(tmp_path, vectors[:written])
+            with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+                json.dump({"count": written, "dim": int(vectors.shape[1]), "quantization": self.quantization,
+                           "collection_version": collection_version, "created_at": time.time()}, f)
+            del vectors
+
+            os.replace(tmp_path, os.path.join(self.index_dir, name))
+            pointer = os.path.join(self.index_dir, "CURRENT")
+            with open(pointer + ".tmp", "w") as f:
+                f.write(name)
+            os.replace(pointer + ".tmp", pointer)
+            self._cleanup(keep={name, self.generation})
+            print(f"🗂️ Vector index snapshot {name}: {written} vectors in {time.monotonic() - started:.1f}s")
+        self.refresh()
+        return name
+
+    def _write_quantized(self, path: str, vectors: np.ndarray):
+        if self.quantization == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+            quantized = np.lib.format.open_memmap(
+                os.path.join(path, "vectors.i8.npy"), mode="w+", dtype=np.int8, shape=vectors.shape
+            )
+            for start in range(0, len(vectors), SCAN_BLOCK):
+                block = vectors[start:start + SCAN_BLOCK]
+                quantized[start:start + SCAN_BLOCK] = np.round(block / scales[start:start + SCAN_BLOCK, None])
+            quantized.flush()
+            np.save(os.path.join(path, "scales.npy"), scales)
+        elif self.quantization == "float16":
+            np.save(os.path.join(path, "vectors.f16.npy"), vectors.astype(np.float16))
+
+    def _unpublish(self):
+        """Empty collection: there is nothing to map, searches fall back to Chroma."""
+        print("🗂️ Collection is empty, vector index disabled until the next export")
+        try:
+            os.remove(os.path.join(self.index_dir, "CURRENT"))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._snapshot = None
+
+    def _cleanup(self, keep: set):
+        # Old snapshots may still be mapped by a worker: files stay valid until unmapped
+        for entry in os.listdir(self.index_dir):
+            if entry.startswith("snapshot-") and entry not in keep:
+                shutil.rmtree(os.path.join(self.index_dir, entry), ignore_errors=True)
+
+    # --- loading ---
+    def refresh(self):
+        """Maps the snapshot CURRENT points to, if it isn't the loaded one."""
+        self._last_check = time.monotonic()
+        try:
+            with open(os.path.join(self.index_dir, "CURRENT")) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            with self._lock:
+                self._snapshot = None
+            return
+        if name == self.generation:
+            return
+        try:
+            snapshot = Snapshot(os.path.join(self.index_dir, name))
+        except Exception as e:
+            print(f"⚠️ Could not load vector index snapshot {name}: {e}")
+            return
+        with self._lock:
+            self._snapshot = snapshot
+        print(f"🗂️ Vector index mapped {name} ({snapshot.count} vectors, {snapshot.quantization})")
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._last_check > self.refresh_interval:
+            self.refresh()
+
+    # --- search ---
+    def _scan(self, snapshot: Snapshot, query: np.ndarray) -> np.ndarray:
+        if snapshot.quantized is None:
+            return snapshot.vectors @ query
+        scores = np.empty(snapshot.count, dtype=np.float32)
+        for start in range(0, snapshot.count, SCAN_BLOCK):
+            block = snapshot.quantized[start:start + SCAN_BLOCK].astype(np.float32)
+            scores[start:start + SCAN_BLOCK] = block @ query
+        if snapshot.scales is not None:
+            scores *= snapshot.scales
+        return scores
+
+    def search(self, embedding, k: int) -> list[Document]:
+        self._maybe_refresh()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.count == 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-12
+
+        scores = self._scan(snapshot, query)
+        k = min(k, snapshot.count)
+        if snapshot.quantized is not None:
+            # Approximate scan, exact float32 rescoring of the best candidates
+            candidates = min(snapshot.count, k * self.rescore_factor)
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+            top = np.sort(top)  # sequential reads on the map
+            exact = snapshot.vectors[top] @ query
+            order = top[np.argsort(-exact)[:k]]
+        else:
+            top = np.argpartition(-scores, k - 1)[:k]
+            order = top[np.argsort(-scores[top])]
+
+        return [
+            Document(
+                id=snapshot.ids[i],
+                page_content=snapshot.documents[i],
+                metadata=json.loads(snapshot.metadatas[i]),
+            )
+            for i in order
+        ]
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "generation": self.generation,
+            "vectors": snapshot.count if snapshot else 0,
+            "quantization": snapshot.quantization if snapshot else self.quantization,
+        }
+
+
+if __name__ == "__main__":
+    from langchain_chroma import Chroma
+    from retriever import get_chroma_client
+    from catalog import get_catalog
+    from constants import COLLECTION_NAME
+
+    os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+    store = Chroma(client=get_chroma_client(), collection_name=COLLECTION_NAME)
+    MmapVectorIndex().export_from(store._collection, get_catalog().version())
@@ -32,7 +32,24 @@ resource "aws_lb_listener_rule" "backend_rule" {
 
   condition {
     path_pattern {
-      values = ["/query", "/history/*", "/docs", "/openapi.json", "/ingest-s3"]
+      values = ["/query*", "/history/*", "/docs", "/openapi.json", "/ingest-s3*"]
+    }
+  }
+}
+
+# --- ADDITIONAL RULE FOR FILES AND JOBS (To overcome the 5 path limit) ---
+resource "aws_lb_listener_rule" "backend_files_rule" {
+  listener_arn = aws_lb_listener.http.arn
+  priority     = 101 # Different priority required
+
+  action {
+    type             = "forward"
+    target_group_arn = aws_lb_target_group.backend.arn # Always sends to the same backend
+  }
+
+  condition {
+    path_pattern {
+      values = ["/files", "/files/*", "/jobs/*"]
     }
   }
 }
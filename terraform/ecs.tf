@@ -121,6 +121,14 @@ resource "aws_ecs_task_definition" "backend" {
         { name = "CHROMA_SERVER_PORT", value = "8000" },
         { name = "TELEGRAM_TOKEN", value = var.telegram_token }
       ]
+      # Liveness only: readiness (/readyz) waits for the model, a slow cold start must not kill the task
+      healthCheck = {
+        command     = ["CMD-SHELL", "python -c \"import urllib.request; urllib.request.urlopen('http://127.0.0.1:8002/healthz')\" || exit 1"]
+        interval    = 15
+        timeout     = 5
+        retries     = 3
+        startPeriod = 60
+      }
       logConfiguration = {
         logDriver = "awslogs"
         options = { "awslogs-group" = "/ecs/cloud-nlp-backend", "awslogs-region" = "us-east-1", "awslogs-stream-prefix" = "rag" }